@@ -0,0 +1,231 @@
+"""
+Dominant colour extraction from item photos.
+
+Photos are downsampled with Pillow and their pixels clustered with k-means
+in CIELAB space (so distances follow perceived colour difference). The
+cluster that dominates the photo's border is treated as background and
+dropped. The remaining clusters are matched to the nearest palette colour,
+named the way the wardrobe's colour vocabulary already spells it, and
+stored on the item with the share of the photo they cover as confidence.
+
+Process every image that hasn't been analysed yet with:
+
+    python color_extraction.py [--workers N]
+"""
+import argparse
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image as PILImage
+
+from database import Color, Image, Item, item_colors
+from palette import COLOR_ALIASES, COLOR_RGB, normalize_color_name
+
+THUMBNAIL_SIZE = 64
+CLUSTERS = 5
+ITERATIONS = 12
+# Clusters covering less of the photo than this are not reported
+MIN_CONFIDENCE = 0.15
+# A cluster holding this share of the border pixels is the background
+BACKGROUND_SHARE = 0.6
+
+def rgb_to_lab(rgb):
+    """Convert an (n, 3) array of sRGB values in 0-255 to CIELAB (D65)."""
+    rgb = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ np.array([
+        [0.4124, 0.2126, 0.0193],
+        [0.3576, 0.7152, 0.1192],
+        [0.1805, 0.0722, 0.9505],
+    ], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+# Palette in Lab
+PALETTE_NAMES = list(COLOR_RGB)
+PALETTE_LAB = rgb_to_lab([COLOR_RGB[name] for name in PALETTE_NAMES])
+
+def load_pixels(source, size=THUMBNAIL_SIZE):
+    """Return the downsampled photo as an (h, w, 3) uint8 array."""
+    with PILImage.open(source) as image:
+        image.draft('RGB', (size * 2, size * 2))
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        return np.asarray(image)
+
+def squared_distances(points, centroids):
+    return (
+        (points ** 2).sum(axis=1)[:, None]
+        - 2 * points @ centroids.T
+        + (centroids ** 2).sum(axis=1)[None, :]
+    )
+
+def kmeans(points, k=CLUSTERS, iterations=ITERATIONS, seed=0):
+    """
+    Cluster points with k-means (k-means++ seeding).
+
+    Returns (centroids, labels). Fewer than k centroids are returned when
+    the points have fewer distinct values.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = points[[rng.integers(len(points))]]
+    for _ in range(1, k):
+        nearest = squared_distances(points, centroids).min(axis=1).clip(min=0)
+        total = nearest.sum()
+        if total == 0:
+            break
+        centroids = np.vstack([centroids, points[rng.choice(len(points), p=nearest / total)]])
+
+    for _ in range(iterations):
+        labels = squared_distances(points, centroids).argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centroids)).astype(np.float32)
+        sums = np.stack([np.bincount(labels, weights=points[:, channel], minlength=len(centroids)) for channel in range(3)], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids)
+        if np.allclose(updated, centroids, atol=0.5):
+            break
+        centroids = updated.astype(np.float32)
+    labels = squared_distances(points, centroids).argmin(axis=1)
+    return centroids, labels
+
+def dominant_colors(source, k=CLUSTERS, min_confidence=MIN_CONFIDENCE):
+    """
+    Return [(palette colour, confidence), ...] for a photo, most dominant first.
+
+    Confidence is the share of the (non-background) photo the colour covers.
+    """
+    pixels = load_pixels(source)
+    height, width, _ = pixels.shape
+    points = rgb_to_lab(pixels.reshape(-1, 3))
+    centroids, labels = kmeans(points, k)
+    labels = labels.reshape(height, width)
+
+    # The cluster filling most of the border is the background
+    border = np.concatenate([labels[0], labels[-1], labels[1:-1, 0], labels[1:-1, -1]])
+    border_counts = np.bincount(border, minlength=len(centroids))
+    foreground = np.ones(len(centroids), dtype=bool)
+    if border_counts.max() >= BACKGROUND_SHARE * len(border):
+        foreground[border_counts.argmax()] = False
+
+    counts = np.bincount(labels.ravel(), minlength=len(centroids)).astype(np.float32)
+    counts[~foreground] = 0
+    if counts.sum() == 0:
+        return []
+    shares = counts / counts.sum()
+
+    # Merge clusters that map to the same palette colour
+    nearest = squared_distances(centroids, PALETTE_LAB).argmin(axis=1)
+    confidence = {}
+    for cluster, palette_index in enumerate(nearest):
+        if shares[cluster] > 0:
+            name = PALETTE_NAMES[palette_index]
+            confidence[name] = confidence.get(name, 0.0) + float(shares[cluster])
+    found = [(name, round(share, 3)) for name, share in confidence.items() if share >= min_confidence]
+    return sorted(found, key=lambda pair: -pair[1])
+
+def safe_dominant_colors(path):
+    """dominant_colors() for worker processes; None if the file isn't a readable image."""
+    try:
+        return dominant_colors(path)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+
+class ColorVocabulary:
+    """Existing Color rows keyed by palette name, creating new ones on demand."""
+    def __init__(self, db):
+        self.db = db
+        self.colors = {}
+        for color in db.query(Color).order_by(Color.id):
+            key = normalize_color_name(color.name) or color.name.lower()
+            current = self.colors.get(key)
+            # An exact name ("Green", or "Gray" for grey) beats one that only
+            # ends in it ("Forest Green")
+            if current is None or (self._is_exact(color, key) and not self._is_exact(current, key)):
+                self.colors[key] = color
+
+    @staticmethod
+    def _is_exact(color, key):
+        name = color.name.strip().lower()
+        return COLOR_ALIASES.get(name, name) == key
+
+    def get(self, palette_name):
+        color = self.colors.get(palette_name)
+        if color is None:
+            color = Color(name=palette_name.title())
+            self.db.add(color)
+            self.db.flush()
+            self.colors[palette_name] = color
+        return color
+
+def apply_extracted_colors(db, item, image, found, vocabulary=None):
+    """
+    Store extracted colours on an item and mark the image as analysed.
+
+    Colours the item already has are left alone, so user-entered colours keep
+    an empty confidence. Returns [(colour name, confidence), ...] as stored.
+    """
+    vocabulary = vocabulary or ColorVocabulary(db)
+    existing = {color_id for (color_id,) in db.query(item_colors.c.color_id).filter(item_colors.c.item_id == item.id)}
+    stored = []
+    for palette_name, confidence in found or []:
+        color = vocabulary.get(palette_name)
+        if color.id in existing:
+            continue
+        db.execute(item_colors.insert().values(item_id=item.id, color_id=color.id, confidence=confidence))
+        existing.add(color.id)
+        stored.append((color.name, confidence))
+
+    image.colors_extracted_at = datetime.datetime.utcnow()
+    if stored:
+        # Touch the item so the change feed (and its caches) see the new colours
+        item.updated_at = datetime.datetime.utcnow()
+        db.expire(item, ['colors'])
+    return stored
+
+def backfill(db, upload_dir, workers=None, batch_size=200):
+    """Extract colours for every image not analysed yet, across all cores. Returns the number processed."""
+    pending = (
+        db.query(Image)
+        .filter(Image.colors_extracted_at.is_(None), Image.item_id.isnot(None))
+        .order_by(Image.id)
+        .all()
+    )
+    if not pending:
+        return 0
+    paths = [os.path.join(upload_dir, image.filename) for image in pending]
+    vocabulary = ColorVocabulary(db)
+    items = {}
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image, found in zip(pending, executor.map(safe_dominant_colors, paths, chunksize=16)):
+            item = items.get(image.item_id) or db.get(Item, image.item_id)
+            items[image.item_id] = item
+            apply_extracted_colors(db, item, image, found, vocabulary)
+            processed += 1
+            if processed % batch_size == 0:
+                db.commit()
+    db.commit()
+    return processed
+
+if __name__ == "__main__":
+    from database import open_session, shard_name
+
+    parser = argparse.ArgumentParser(description="Extract dominant colours from item photos that haven't been analysed yet.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--upload-dir", default="uploads")
+    parser.add_argument("--user", help="In multi-tenant mode, the user whose shard to process")
+    args = parser.parse_args()
+
+    shard = shard_name(args.user) if args.user else None
+    upload_dir = f"{args.upload_dir}/{shard}" if shard else args.upload_dir
+    db = open_session(shard)
+    try:
+        start = time.perf_counter()
+        count = backfill(db, upload_dir, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Processed {count} images in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.1f} images/s)")
+    finally:
+        db.close()
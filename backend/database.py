@@ -1,19 +1,53 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Table
+from sqlalchemy import create_engine, event, inspect, select, delete, insert, update, Column, Integer, Float, String, DateTime, Boolean, ForeignKey, Index, Table, UniqueConstraint, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from sqlalchemy.pool import StaticPool
+from fastapi import HTTPException, Request
+from collections import OrderedDict
 import datetime
+import hashlib
 import os
+import re
+import sqlite3
+import threading
+import time
 
 # Create database directory if it doesn't exist
 os.makedirs("db", exist_ok=True)
 
+def make_engine(url):
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer of each database file
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 # Create SQLite database engine
 SQLALCHEMY_DATABASE_URL = "sqlite:///./db/capsulib.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Multi-tenant mode: every user gets their own database file and upload
+# directory, so writers don't share a single SQLite lock.
+MULTI_TENANT = os.environ.get("CAPSULIB_MULTI_TENANT", "").lower() in ("1", "true", "yes")
+# Header carrying the user id in multi-tenant mode
+TENANT_HEADER = "X-Capsulib-User"
+# Requests with these methods never create a user's database
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Bounds on open shard engines
+MAX_OPEN_SHARDS = int(os.environ.get("CAPSULIB_MAX_OPEN_SHARDS", "64"))
+SHARD_IDLE_TIMEOUT = float(os.environ.get("CAPSULIB_SHARD_IDLE_TIMEOUT", "300"))
+SHARD_DIR = os.path.join("db", "shards")
+
 # Create base class for models
 Base = declarative_base()
 
@@ -23,6 +57,8 @@ item_colors = Table(
     Base.metadata,
     Column("item_id", Integer, ForeignKey("items.id")),
     Column("color_id", Integer, ForeignKey("colors.id")),
+    # Set when the colour was extracted from a photo; None for user-entered colours
+    Column("confidence", Float, nullable=True),
 )
 
 # Association table for item materials (many-to-many)
@@ -49,8 +85,19 @@ class Material(Base):
     
     items = relationship("Item", secondary=item_materials, back_populates="materials")
 
+# Lifecycle of an item; only active items are part of the current wardrobe
+ITEM_STATUSES = ("active", "archived", "donated", "sold")
+
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        # Partial index over the active items only: everyday queries stay
+        # proportional to the current wardrobe, not to everything ever owned
+        Index("ix_items_active", "id", sqlite_where=text("status = 'active'"), postgresql_where=text("status = 'active'")),
+        # Never reuse the id of a deleted item, which the change feed and
+        # marketplace listings still refer to (new databases only)
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     brand = Column(String, index=True)
@@ -64,6 +111,7 @@ class Item(Base):
     season = Column(String, nullable=True)
     is_second_hand = Column(String, nullable=True)
     pattern = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="active", server_default="active")
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
@@ -77,16 +125,301 @@ class Image(Base):
     id = Column(Integer, primary_key=True, index=True)
     item_id = Column(Integer, ForeignKey("items.id"))
     filename = Column(String)
+    # 64-bit perceptual hash (dHash) as 16 hex characters, None if not an image
+    phash = Column(String(16), nullable=True, index=True)
+    colors_extracted_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     item = relationship("Item", back_populates="images")
 
+class ItemChange(Base):
+    """
+    Change feed used for delta sync.
+
+    Holds at most one row per item: every write to an item, its images or its
+    colors/materials replaces that row with a new, higher `seq`. Deleted items
+    keep their row as a tombstone so clients can drop them locally.
+    """
+    __tablename__ = "item_changes"
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse a seq
+
+    seq = Column(Integer, primary_key=True)
+    item_id = Column(Integer, unique=True, index=True)
+    deleted = Column(Boolean, default=False)
+    changed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class MarketplaceListing(Base):
+    """
+    Sync state of one item on one marketplace.
+
+    `state` is "pending" (publish or refresh needed), "listed",
+    "pending_delete", "delisted" or "failed" (gave up after repeated errors).
+    """
+    __tablename__ = "marketplace_listings"
+    __table_args__ = (UniqueConstraint("provider", "item_id"),)
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, index=True)
+    # No foreign key: the row outlives the item until it is delisted
+    item_id = Column(Integer, index=True)
+    external_id = Column(String, nullable=True)
+    state = Column(String, default="pending", index=True)
+    content_hash = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    synced_at = Column(DateTime, nullable=True)
+
+class MarketplaceSyncState(Base):
+    """How far each marketplace has consumed the item change feed."""
+    __tablename__ = "marketplace_sync_state"
+
+    provider = Column(String, primary_key=True)
+    cursor = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+def record_item_changes(connection, item_ids, deleted=False):
+    """Move the given items to the head of the change feed."""
+    item_ids = sorted(set(item_ids))
+    if not item_ids:
+        return
+    now = datetime.datetime.utcnow()
+    connection.execute(delete(ItemChange.__table__).where(ItemChange.item_id.in_(item_ids)))
+    connection.execute(
+        insert(ItemChange.__table__),
+        [{"item_id": item_id, "deleted": deleted, "changed_at": now} for item_id in item_ids],
+    )
+    if deleted:
+        withdraw_listings(connection, item_ids)
+
+def withdraw_listings(connection, item_ids):
+    """
+    Queue the marketplace listings of deleted items for removal.
+
+    Published listings are detached from the item, whose id an older
+    database may hand to the next new item; unpublished ones are dropped.
+    """
+    listings = MarketplaceListing.__table__
+    connection.execute(
+        delete(listings).where(listings.c.item_id.in_(item_ids), listings.c.external_id.is_(None))
+    )
+    connection.execute(
+        update(listings)
+        .where(listings.c.item_id.in_(item_ids))
+        .values(item_id=None, state="pending_delete", attempts=0, last_error=None)
+    )
+
+@event.listens_for(Session, "after_flush")
+def _track_item_changes(session, flush_context):
+    # Collect the items touched by this flush. Changes to the colors and
+    # materials collections mark the owning item dirty, so association rows
+    # are covered by the Item branch.
+    changed = set()
+    deleted = set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Item) and obj.id is not None:
+            changed.add(obj.id)
+        elif isinstance(obj, Image) and obj.item_id is not None:
+            changed.add(obj.item_id)
+    for obj in session.deleted:
+        if isinstance(obj, Item) and obj.id is not None:
+            deleted.add(obj.id)
+        elif isinstance(obj, Image) and obj.item_id is not None:
+            changed.add(obj.item_id)
+
+    connection = session.connection()
+    record_item_changes(connection, changed - deleted)
+    record_item_changes(connection, deleted, deleted=True)
+
+# Item ids per IN clause, under SQLite's default limit of 999 bound parameters
+IN_BATCH_SIZE = 900
+
+def in_batches(ids, size=IN_BATCH_SIZE):
+    """Split a list of ids into chunks small enough for one IN clause."""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def item_changes_since(db, cursor):
+    """
+    Read the change feed after `cursor`.
+
+    Returns (new cursor, changed item ids, deleted item ids), oldest change
+    first; the cursor is unchanged when nothing happened.
+    """
+    changes = (
+        db.query(ItemChange.seq, ItemChange.item_id, ItemChange.deleted)
+        .filter(ItemChange.seq > cursor)
+        .order_by(ItemChange.seq)
+        .all()
+    )
+    if not changes:
+        return cursor, [], []
+    changed = [item_id for _, item_id, deleted in changes if not deleted]
+    deleted = [item_id for _, item_id, deleted in changes if deleted]
+    return changes[-1].seq, changed, deleted
+
+class PerDatabase:
+    """
+    One object per database, created by `factory` on first use.
+
+    Used for in-memory caches built from a database. Entries are dropped
+    when their engine is disposed, as shard engines are when evicted.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, db):
+        key = str(db.get_bind().url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = self.factory()
+            return entry
+
+    def drop(self, engine):
+        with self.lock:
+            self.entries.pop(str(engine.url), None)
+
+_per_database = []
+
+def per_database(factory):
+    """Return a registry holding one `factory()` object per database."""
+    registry = PerDatabase(factory)
+    _per_database.append(registry)
+    return registry
+
+@event.listens_for(Engine, "engine_disposed")
+def _drop_per_database(engine):
+    for registry in _per_database:
+        registry.drop(engine)
+
+def _add_missing_columns(engine):
+    # create_all only creates missing tables; add columns introduced since a
+    # database was created so existing wardrobes keep working.
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = f" DEFAULT '{column.server_default.arg}'" if column.server_default is not None else ""
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}{default}')
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+def _seed_item_changes(engine):
+    # Databases created before the change feed existed have items without a
+    # feed entry; give them one so a full sync from cursor 0 sees everything.
+    with engine.begin() as connection:
+        missing = connection.execute(
+            select(Item.id).where(Item.id.not_in(select(ItemChange.item_id)))
+        ).scalars().all()
+        record_item_changes(connection, missing)
+
+def init_database(engine):
+    """Create or upgrade the schema of a database."""
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+    _seed_item_changes(engine)
+
 # Create tables in the database
-Base.metadata.create_all(bind=engine)
+init_database(engine)
+
+def shard_name(user_id):
+    """Return the shard holding a user's data."""
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", user_id):
+        return f"user-{user_id}"
+    # Keep arbitrary ids out of file names
+    return "user-" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+
+class ShardPool:
+    """
+    LRU of open shard engines.
+
+    Shards are created and migrated the first time they are written to. At most
+    `max_open` engines stay open; the least recently used ones, and any idle
+    for longer than `idle_timeout` seconds, are disposed. Sessions still
+    using a disposed engine keep their connection until they close.
+    """
+    def __init__(self, directory=SHARD_DIR, max_open=MAX_OPEN_SHARDS, idle_timeout=SHARD_IDLE_TIMEOUT):
+        self.directory = directory
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.shards = OrderedDict()  # shard -> (sessionmaker, last used)
+        self.initialized = set()
+
+    def sessionmaker(self, shard, create=True):
+        """Return the session factory for a shard, or None if it doesn't exist and create is False."""
+        with self.lock:
+            now = time.monotonic()
+            entry = self.shards.pop(shard, None)
+            if entry is None:
+                path = os.path.join(self.directory, f"{shard}.db")
+                if not create and not os.path.exists(path):
+                    return None
+                os.makedirs(self.directory, exist_ok=True)
+                shard_engine = make_engine(f"sqlite:///./{self.directory}/{shard}.db")
+                if shard not in self.initialized:
+                    init_database(shard_engine)
+                    self.initialized.add(shard)
+                factory = sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+            else:
+                factory = entry[0]
+            self.shards[shard] = (factory, now)
+            self._evict(now)
+            return factory
+
+    def _evict(self, now):
+        while self.shards:
+            shard, (factory, last_used) = next(iter(self.shards.items()))
+            if len(self.shards) <= self.max_open and now - last_used < self.idle_timeout:
+                break
+            del self.shards[shard]
+            factory.kw["bind"].dispose()
+
+    def dispose(self):
+        with self.lock:
+            for factory, _ in self.shards.values():
+                factory.kw["bind"].dispose()
+            self.shards.clear()
+
+shard_pool = ShardPool()
+
+def open_session(shard=None, create=True):
+    """
+    Open a session on a shard, or on the single database when shard is None.
+
+    With create=False a shard that doesn't exist yet isn't created; the
+    session reads from an empty in-memory database instead, so looking at an
+    unknown user's wardrobe leaves no file behind.
+    """
+    if shard is None:
+        return SessionLocal()
+    factory = shard_pool.sessionmaker(shard, create=create)
+    if factory is None:
+        # One shared connection: the request may use the session from several threads
+        empty_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        init_database(empty_engine)
+        return Session(bind=empty_engine, autoflush=False)
+    return factory()
+
+def get_shard(request: Request):
+    """Return the shard for a request, or None outside multi-tenant mode."""
+    if not MULTI_TENANT:
+        return None
+    user_id = request.headers.get(TENANT_HEADER)
+    if not user_id:
+        raise HTTPException(status_code=400, detail=f"Missing {TENANT_HEADER} header")
+    return shard_name(user_id)
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
+def get_db(request: Request):
+    # A user's database is created by their first write, not by any read
+    db = open_session(get_shard(request), create=request.method not in SAFE_METHODS)
     try:
         yield db
     finally:
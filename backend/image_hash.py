@@ -0,0 +1,200 @@
+"""
+Perceptual image hashes and a near-duplicate index.
+
+Each uploaded image gets a 64-bit difference hash (dHash): visually
+identical photos (re-encoded, resized, slightly edited) land within a few
+bits of each other. A BK-tree over Hamming distance answers "which images
+are within N bits of this one" without comparing against every image.
+
+Backfill hashes for existing uploads with:
+
+    python image_hash.py [--workers N]
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as PILImage
+from database import Image, in_batches, item_changes_since, per_database, record_item_changes
+
+HASH_SIZE = 8
+
+def dhash(source, hash_size=HASH_SIZE):
+    """Return the difference hash of an image file or file object as an int."""
+    with PILImage.open(source) as image:
+        # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+        image.draft('L', (hash_size * 4, hash_size * 4))
+        image = image.convert('L').resize((hash_size + 1, hash_size), PILImage.Resampling.LANCZOS)
+        pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+def hash_to_str(value):
+    return format(value, '016x')
+
+def str_to_hash(text):
+    return int(text, 16)
+
+def compute_phash(path):
+    """Return the hex hash for an image file, or None if it can't be read as an image."""
+    try:
+        return hash_to_str(dhash(path))
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+
+    Each node stores the keys sharing one hash; children are indexed by
+    their distance to the node. A search only descends into children whose
+    distance lies within max_distance of the query's distance to the node
+    (triangle inequality), pruning most of the tree for small radii.
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, key):
+        if self.root is None:
+            self.root = [value, {key}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {key}, {}]
+                return
+            node = child
+
+    def remove(self, value, key):
+        # Emptied nodes stay in place to keep the tree's distances valid
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].discard(key)
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, max_distance):
+        """Return (distance, key) pairs within max_distance of value, closest first."""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, key) for key in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort()
+        return results
+
+class ImageHashIndex:
+    """Near-duplicate index for one database, refreshed from the item change feed."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cursor = 0
+        self.tree = BKTree()
+        self.images = {}  # image id -> (item id, filename, hash)
+        self.item_images = {}  # item id -> set of image ids
+
+    def _remove_item(self, item_id):
+        for image_id in self.item_images.pop(item_id, ()):
+            _, _, value = self.images.pop(image_id)
+            self.tree.remove(value, image_id)
+
+    def refresh(self, db):
+        with self.lock:
+            cursor, changed_ids, deleted_ids = item_changes_since(db, self.cursor)
+            if cursor == self.cursor:
+                return
+            self.cursor = cursor
+            for item_id in changed_ids + deleted_ids:
+                self._remove_item(item_id)
+            for batch in in_batches(changed_ids):
+                rows = db.query(Image.id, Image.item_id, Image.filename, Image.phash).filter(
+                    Image.item_id.in_(batch), Image.phash.isnot(None)
+                )
+                for image_id, item_id, filename, phash in rows:
+                    value = str_to_hash(phash)
+                    self.images[image_id] = (item_id, filename, value)
+                    self.item_images.setdefault(item_id, set()).add(image_id)
+                    self.tree.add(value, image_id)
+
+    def similar_images(self, value, max_distance):
+        """Return (distance, image id, item id, filename) for images near a hash."""
+        with self.lock:
+            return [(distance, image_id) + self.images[image_id][:2] for distance, image_id in self.tree.search(value, max_distance)]
+
+_indexes = per_database(ImageHashIndex)
+
+def get_hash_index(db):
+    """Return the up-to-date near-duplicate index for a session's database."""
+    index = _indexes.get(db)
+    index.refresh(db)
+    return index
+
+def backfill(db, upload_dir, workers=None, batch_size=500):
+    """Hash every stored image that has no hash yet, in parallel. Returns the number hashed."""
+    pending = db.query(Image.id, Image.item_id, Image.filename).filter(Image.phash.is_(None)).all()
+    if not pending:
+        return 0
+    paths = [os.path.join(upload_dir, filename) for _, _, filename in pending]
+    hashed = 0
+    changed_items = set()
+
+    def commit():
+        # Bulk updates skip the session's change tracking; publish the items
+        # so running indexes pick up the new hashes
+        record_item_changes(db.connection(), changed_items)
+        db.commit()
+        changed_items.clear()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(compute_phash, paths, chunksize=32)
+        for (image_id, item_id, _), phash in zip(pending, results):
+            if phash is None:
+                continue
+            db.query(Image).filter(Image.id == image_id).update({Image.phash: phash}, synchronize_session=False)
+            if item_id is not None:
+                changed_items.add(item_id)
+            hashed += 1
+            if hashed % batch_size == 0:
+                commit()
+    commit()
+    return hashed
+
+if __name__ == "__main__":
+    from database import open_session, shard_name
+
+    parser = argparse.ArgumentParser(description="Compute perceptual hashes for uploaded images that don't have one yet.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--upload-dir", default="uploads")
+    parser.add_argument("--user", help="In multi-tenant mode, the user whose shard to process")
+    args = parser.parse_args()
+
+    shard = shard_name(args.user) if args.user else None
+    upload_dir = f"{args.upload_dir}/{shard}" if shard else args.upload_dir
+    db = open_session(shard)
+    try:
+        start = time.perf_counter()
+        count = backfill(db, upload_dir, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Hashed {count} images in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} images/s)")
+    finally:
+        db.close()
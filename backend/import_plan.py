@@ -0,0 +1,297 @@
+"""
+Import planner: infer column types once, then convert rows without guessing.
+
+A sample of the uploaded file is profiled to find each column's date format,
+decimal and currency convention, list separator and boolean vocabulary. An
+ImportPlan then binds one converter function to each mapped column, so every
+row goes through the same straight-line conversion.
+"""
+import re
+from datetime import datetime
+from itertools import islice
+
+# Number of rows inspected to infer column types
+SAMPLE_SIZE = 200
+
+# Tried in order; the first format matching the most sample values wins
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%m/%d/%Y',
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%Y/%m/%d',
+]
+# Guessed per value, in this order, when a date doesn't fit the column's format
+FALLBACK_DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y']
+
+LIST_SEPARATORS = [';', '|', ',']
+
+TRUE_WORDS = {'true', 'yes', 'y', '1', 'x', 'second-hand', 'secondhand', 'second hand', 'used', 'pre-owned', 'ja', 'waar'}
+FALSE_WORDS = {'false', 'no', 'n', '0', 'new', 'first-hand', 'firsthand', 'nee', 'onwaar'}
+
+CURRENCY_PATTERN = re.compile(r'[€$£]|\b[A-Z]{3}\b')
+MONEY_PATTERN = re.compile(r'^(?:[€$£]|[A-Z]{3})?\s*-?[\d.,\s]*\d\s*(?:[€$£]|[A-Z]{3})?$')
+NON_NUMERIC_PATTERN = re.compile(r'[^\d,.\-]')
+ANY_SEPARATOR_PATTERN = re.compile(r'[;|,]')
+LONE_DECIMAL_PATTERN = re.compile(r'^-?\d*[.,]\d{1,2}$')
+NUMERIC_DATE_PATTERN = re.compile(r'^%([dmY])([/.\-])%([dmY])(\2)%([dmY])$')
+
+def sample_rows(rows, size=SAMPLE_SIZE):
+    """Split a row iterator into (sample, rows), where rows still yields everything."""
+    rows = iter(rows)
+    sample = list(islice(rows, size))
+
+    def iter_all():
+        yield from sample
+        yield from rows
+
+    return sample, iter_all()
+
+def column_values(sample, column):
+    """Return the non-empty, stripped values of a column in the sample."""
+    values = []
+    for row in sample:
+        value = (row.get(column) or '').strip()
+        if value:
+            values.append(value)
+    return values
+
+def infer_date_format(values):
+    """Return the date format matching the most values, or None if none match."""
+    best_format, best_matches = None, 0
+    for date_format in DATE_FORMATS:
+        matches = 0
+        for value in values:
+            try:
+                datetime.strptime(value, date_format)
+                matches += 1
+            except ValueError:
+                pass
+        if matches > best_matches:
+            best_format, best_matches = date_format, matches
+    return best_format
+
+def infer_decimal_separator(values):
+    """Return ',' or '.' depending on how the sample writes decimals, or None if it can't tell."""
+    comma_votes = point_votes = 0
+    for value in values:
+        digits = NON_NUMERIC_PATTERN.sub('', value)
+        last_comma, last_point = digits.rfind(','), digits.rfind('.')
+        if last_comma > last_point:
+            # "12,50" or "1.234,56"; "1,234" alone is a thousands separator
+            if len(digits) - last_comma - 1 != 3 or last_point != -1:
+                comma_votes += 1
+        elif last_point > last_comma:
+            if len(digits) - last_point - 1 != 3 or last_comma != -1:
+                point_votes += 1
+    if point_votes == comma_votes:
+        return None
+    return '.' if point_votes > comma_votes else ','
+
+def infer_currency(values):
+    """Return the currency symbol or code used in the sample, if any."""
+    for value in values:
+        match = CURRENCY_PATTERN.search(value)
+        if match:
+            return match.group(0)
+    return None
+
+def infer_list_separator(values):
+    """Return the most common list separator in the sample, or None."""
+    counts = {separator: sum(value.count(separator) for value in values) for separator in LIST_SEPARATORS}
+    separator = max(LIST_SEPARATORS, key=lambda s: counts[s])
+    return separator if counts[separator] else None
+
+def infer_boolean_vocabulary(values):
+    """
+    Return the set of values meaning True, or None if the column isn't boolean.
+
+    Known words are recognised directly. A column with exactly two distinct
+    values where only one is known treats the other as its opposite.
+    """
+    distinct = {value.lower() for value in values}
+    unknown = distinct - TRUE_WORDS - FALSE_WORDS
+    if not unknown:
+        return TRUE_WORDS
+    if len(distinct) == 2 and len(unknown) == 1:
+        known = (distinct - unknown).pop()
+        return TRUE_WORDS if known in TRUE_WORDS else TRUE_WORDS | unknown
+    return None
+
+def describe_column(values):
+    """Describe the type detected for a column's sample values, for previews."""
+    if not values:
+        return 'empty'
+    date_format = infer_date_format(values)
+    if date_format:
+        return f'date ({date_format})'
+    if infer_boolean_vocabulary(values) is not None and not all(v.isdigit() for v in values):
+        return 'boolean (' + '/'.join(sorted({v.lower() for v in values})) + ')'
+    if all(MONEY_PATTERN.match(value) for value in values):
+        currency = infer_currency(values)
+        separator = {',': 'comma', '.': 'point'}.get(infer_decimal_separator(values))
+        details = ', '.join(detail for detail in (separator, currency) if detail)
+        return f'decimal ({details})' if details else 'decimal'
+    separator = infer_list_separator(values)
+    if separator in (';', '|'):
+        return f'list ({separator})'
+    return 'text'
+
+def guess_date(value):
+    """Parse a date that doesn't fit the column's format, trying the common formats."""
+    for date_format in FALLBACK_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return None
+
+def date_converter(values):
+    date_format = infer_date_format(values)
+    if date_format is None:
+        return guess_date
+
+    def parse(value):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            return guess_date(value)
+
+    if date_format == '%Y-%m-%d':
+        def convert(value):
+            # fromisoformat is much faster than strptime but stricter about
+            # zero padding, so only fall back for the odd unpadded date. It
+            # also takes other ISO forms ("20201225"), hence the shape check.
+            if len(value) == 10 and value[4] == value[7] == '-':
+                try:
+                    return datetime.fromisoformat(value)
+                except ValueError:
+                    pass
+            return parse(value)
+        return convert
+
+    match = NUMERIC_DATE_PATTERN.match(date_format)
+    if not match:
+        return parse
+
+    # Plain day/month/year formats: split and build the date directly
+    separator = match.group(2)
+    order = [match.group(1), match.group(3), match.group(5)]
+    year, month, day = order.index('Y'), order.index('m'), order.index('d')
+
+    def convert(value):
+        parts = value.split(separator)
+        # Only what strptime would accept: %Y takes exactly four digits, so
+        # "15/03/21" must not become the year 21
+        if (
+            len(parts) == 3 and len(parts[year]) == 4 and len(parts[month]) <= 2
+            and len(parts[day]) <= 2 and ''.join(parts).isdigit()
+        ):
+            try:
+                return datetime(int(parts[year]), int(parts[month]), int(parts[day]))
+            except ValueError:
+                pass
+        return parse(value)
+
+    return convert
+
+def guess_price(value):
+    """
+    Convert a price without a known decimal convention.
+
+    With both marks present the last one is the decimal point; a single mark
+    is taken as the decimal point, a repeated one as thousands separators.
+    """
+    digits = NON_NUMERIC_PATTERN.sub('', value)
+    last_comma, last_point = digits.rfind(','), digits.rfind('.')
+    if last_comma != -1 and last_point != -1:
+        decimal = ',' if last_comma > last_point else '.'
+    elif digits.count(',') + digits.count('.') == 1:
+        decimal = ',' if last_comma != -1 else '.'
+    else:
+        return digits.replace(',', '').replace('.', '') or None
+    thousands = '.' if decimal == ',' else ','
+    return digits.replace(thousands, '').replace(decimal, '.') or None
+
+def price_converter(values):
+    separator = infer_decimal_separator(values)
+    if separator is None:
+        return guess_price
+    thousands = '.' if separator == ',' else ','
+
+    def convert(value):
+        digits = NON_NUMERIC_PATTERN.sub('', value)
+        if separator not in digits and LONE_DECIMAL_PATTERN.match(digits):
+            # "12.50" in a column that writes "12,50": the odd row's own mark is its decimal point
+            return guess_price(value)
+        return digits.replace(thousands, '').replace(separator, '.') or None
+
+    return convert
+
+def split_any(value):
+    return [part.strip() for part in ANY_SEPARATOR_PATTERN.split(value) if part.strip()]
+
+def list_converter(values):
+    separator = infer_list_separator(values)
+    if not separator:
+        # Single values in the sample; accept any separator later on
+        return split_any
+
+    def convert(value):
+        if separator in value:
+            return [part.strip() for part in value.split(separator) if part.strip()]
+        # Rows written with another separator are split the way they're written
+        return split_any(value)
+
+    return convert
+
+def boolean_converter(values):
+    true_words = infer_boolean_vocabulary(values) or TRUE_WORDS
+
+    def convert(value):
+        return value.lower() in true_words
+
+    return convert
+
+def text_converter(values):
+    def convert(value):
+        return value
+    return convert
+
+# Converter factory per item field; unlisted fields are plain text
+FIELD_CONVERTERS = {
+    'purchase_date': date_converter,
+    'purchase_price': price_converter,
+    'colors': list_converter,
+    'materials': list_converter,
+    'is_second_hand': boolean_converter,
+}
+
+class ImportPlan:
+    """
+    Compiled conversion of mapped file columns to item fields.
+
+    column_mappings: Dict of file column -> item field ('' or None to ignore)
+    sample: Rows used to infer each column's conventions
+    """
+    def __init__(self, column_mappings, sample):
+        self.converters = []
+        for column, field_name in column_mappings.items():
+            if not field_name:
+                continue
+            factory = FIELD_CONVERTERS.get(field_name, text_converter)
+            self.converters.append((column, field_name, factory(column_values(sample, column))))
+
+    def convert(self, row):
+        """Return the item data for a row; empty if no mapped column has a value."""
+        item_data = {}
+        for column, field_name, convert in self.converters:
+            value = row.get(column)
+            if value:
+                value = value.strip()
+                if value:
+                    item_data[field_name] = convert(value)
+        return item_data
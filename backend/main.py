@@ -1,23 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Query, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Query, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional, Dict, Literal
 from datetime import datetime
 import os
 import uuid
 import shutil
 
-import io
-import csv
 import zipfile
+import tempfile
 from fastapi.responses import StreamingResponse
 
 from pydantic import BaseModel
-from database import get_db, Item as DBItem, Color as DBColor, Image as DBImage, Material as DBMaterial
+from database import get_db, get_shard, record_item_changes, SAFE_METHODS, item_colors, ITEM_STATUSES, Item as DBItem, Color as DBColor, Image as DBImage, Material as DBMaterial, ItemChange as DBItemChange, MarketplaceListing as DBMarketplaceListing
+from spreadsheets import MEDIA_TYPES, file_format, iter_file, read_table, write_table
+from import_plan import ImportPlan, column_values, describe_column, sample_rows
+from outfits import build_capsule, get_slot_features, recommend_outfits
+from image_hash import compute_phash, get_hash_index, str_to_hash
+from color_extraction import apply_extracted_colors, safe_dominant_colors
+from marketplaces import MarketplaceError, close_http_client, get_provider
+from marketplaces.sync import PUBLIC_URL, listing_counts, publish_items, sync as sync_marketplace, unpublish_item
 import json
 
 app = FastAPI(title="Capsulib API", description="Manage your capsule wardrobe")
+app.add_event_handler("shutdown", close_http_client)
 
 # Enable CORS for development
 app.add_middleware(
@@ -35,6 +42,19 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Mount static files directory to serve images
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+def get_upload_dir(request: Request, shard: Optional[str] = Depends(get_shard)):
+    # In multi-tenant mode each shard keeps its images in uploads/<shard>/,
+    # created on the user's first write like their database
+    if shard is None:
+        return UPLOAD_DIR
+    upload_dir = f"{UPLOAD_DIR}/{shard}"
+    if request.method not in SAFE_METHODS:
+        os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+# Exports larger than this are spooled to disk instead of memory
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
 # Pydantic models
 class ColorBase(BaseModel):
     name: str
@@ -56,9 +76,12 @@ class ItemBase(BaseModel):
     season: Optional[str] = None
     is_second_hand: Optional[bool] = False
     pattern: Optional[str] = None
+    # Leave empty to keep the current status (new items start active)
+    status: Optional[Literal[ITEM_STATUSES]] = None
 
 class ItemResponse(ItemBase):
     id: int
+    status: str = "active"
     images: List[str] = []
     created_at: datetime
     updated_at: datetime
@@ -66,53 +89,67 @@ class ItemResponse(ItemBase):
     class Config:
         orm_mode = True
 
+class ItemChangesResponse(BaseModel):
+    cursor: int
+    has_more: bool
+    items: List[ItemResponse] = []
+    deleted: List[int] = []
+
+class OutfitResponse(BaseModel):
+    top: int
+    bottom: int
+    shoes: int
+    outerwear: Optional[int] = None
+    score: float
+
+class CapsuleResponse(BaseModel):
+    items: List[int]
+    outfits: List[OutfitResponse]
+
+class ItemColorResponse(BaseModel):
+    name: str
+    confidence: Optional[float] = None
+
+class SimilarImageResponse(BaseModel):
+    filename: str
+    item_id: int
+    distance: int
+
+class SimilarItemResponse(BaseModel):
+    item_id: int
+    distance: int
+
+class MarketplaceListingResponse(BaseModel):
+    # None once the item is deleted and the listing awaits removal
+    item_id: Optional[int] = None
+    state: str
+    external_id: Optional[str] = None
+    attempts: int
+    last_error: Optional[str] = None
+    synced_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class PublishListingsRequest(BaseModel):
+    item_ids: List[int]
+
 class ImportPreviewResponse(BaseModel):
     headers: List[str]
     preview_rows: List[List[str]]
+    detected_types: Dict[str, str] = {}
     available_fields: List[str]
     required_fields: List[str]
 
-@app.get("/")
-def read_root():
-    return {"message": "Welcome to Capsulib API"}
+def image_path(filename, upload_dir=UPLOAD_DIR):
+    # Path of an uploaded image below /uploads; in multi-tenant mode that
+    # includes the shard directory, which clients can't work out themselves
+    if upload_dir == UPLOAD_DIR:
+        return filename
+    return f"{upload_dir[len(UPLOAD_DIR) + 1:]}/{filename}"
 
-@app.get("/items", response_model=List[ItemResponse])
-def get_items(db: Session = Depends(get_db)):
-    db_items = db.query(DBItem).all()
-    
-    # Convert DB models to Pydantic models
-    items = []
-    for db_item in db_items:
-        item_dict = {
-            "id": db_item.id,
-            "brand": db_item.brand,
-            "name": db_item.name,
-            "category": db_item.category,
-            "colors": [color.name for color in db_item.colors],
-            "materials": [material.name for material in db_item.materials],
-            "size": db_item.size,
-            "purchase_date": db_item.purchase_date,
-            "purchase_price": db_item.purchase_price,
-            "condition": db_item.condition,
-            "description": db_item.description,
-            "season": db_item.season,
-            "is_second_hand": db_item.is_second_hand,
-            "pattern": db_item.pattern,
-            "images": [image.filename for image in db_item.images],
-            "created_at": db_item.created_at,
-            "updated_at": db_item.updated_at
-        }
-        items.append(item_dict)
-    
-    return items
-
-@app.get("/items/{item_id}", response_model=ItemResponse)
-def get_item(item_id: int, db: Session = Depends(get_db)):
-    db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
-    if not db_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    item_dict = {
+def item_to_dict(db_item, upload_dir=UPLOAD_DIR):
+    return {
         "id": db_item.id,
         "brand": db_item.brand,
         "name": db_item.name,
@@ -127,15 +164,96 @@ def get_item(item_id: int, db: Session = Depends(get_db)):
         "season": db_item.season,
         "is_second_hand": db_item.is_second_hand,
         "pattern": db_item.pattern,
-        "images": [image.filename for image in db_item.images],
+        "status": db_item.status,
+        "images": [image_path(image.filename, upload_dir) for image in db_item.images],
         "created_at": db_item.created_at,
         "updated_at": db_item.updated_at
     }
+
+@app.get("/")
+def read_root():
+    return {"message": "Welcome to Capsulib API"}
+
+@app.get("/items", response_model=List[ItemResponse])
+def get_items(include_archived: bool = False, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
+    """
+    List the wardrobe.
+    
+    include_archived: Also return archived, donated and sold items
+    """
+    query = db.query(DBItem).options(
+        selectinload(DBItem.colors), selectinload(DBItem.materials), selectinload(DBItem.images)
+    )
+    if not include_archived:
+        query = query.filter(DBItem.status == "active")
+    db_items = query.order_by(DBItem.id).all()
+    
+    # Convert DB models to Pydantic models
+    items = []
+    for db_item in db_items:
+        item_dict = item_to_dict(db_item, upload_dir)
+        items.append(item_dict)
+    
+    return items
+
+@app.get("/items/changes", response_model=ItemChangesResponse)
+def get_item_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    upload_dir: str = Depends(get_upload_dir)
+):
+    """
+    Return the items changed after `since`, oldest change first.
+
+    Pass the returned `cursor` as `since` on the next call; keep paging while
+    `has_more` is true. Each item appears at most once per page, either in
+    `items` (created or updated) or in `deleted` (tombstone).
+    """
+    changes = (
+        db.query(DBItemChange)
+        .filter(DBItemChange.seq > since)
+        .order_by(DBItemChange.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    updated_ids = [change.item_id for change in changes if not change.deleted]
+    deleted_ids = [change.item_id for change in changes if change.deleted]
+
+    db_items = []
+    if updated_ids:
+        db_items = (
+            db.query(DBItem)
+            .options(selectinload(DBItem.colors), selectinload(DBItem.materials), selectinload(DBItem.images))
+            .filter(DBItem.id.in_(updated_ids))
+            .all()
+        )
+    # Keep the feed order so clients apply changes oldest first
+    position = {item_id: i for i, item_id in enumerate(updated_ids)}
+    db_items.sort(key=lambda db_item: position[db_item.id])
+
+    return {
+        "cursor": changes[-1].seq if changes else since,
+        "has_more": has_more,
+        "items": [item_to_dict(db_item, upload_dir) for db_item in db_items],
+        "deleted": deleted_ids
+    }
+
+@app.get("/items/{item_id}", response_model=ItemResponse)
+def get_item(item_id: int, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
+    db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    item_dict = item_to_dict(db_item, upload_dir)
     
     return item_dict
 
 @app.post("/items", response_model=ItemResponse)
-def create_item(item: ItemBase, db: Session = Depends(get_db)):
+def create_item(item: ItemBase, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
     # Create new item
     db_item = DBItem(
         brand=item.brand,
@@ -148,7 +266,8 @@ def create_item(item: ItemBase, db: Session = Depends(get_db)):
         description=item.description,
         season=item.season,
         is_second_hand=item.is_second_hand,
-        pattern=item.pattern
+        pattern=item.pattern,
+        status=item.status or "active"
     )
     
     # Handle colors (create if they don't exist)
@@ -174,30 +293,12 @@ def create_item(item: ItemBase, db: Session = Depends(get_db)):
     db.refresh(db_item)
     
     # Convert to response model
-    item_dict = {
-        "id": db_item.id,
-        "brand": db_item.brand,
-        "name": db_item.name,
-        "category": db_item.category,
-        "colors": [color.name for color in db_item.colors],
-        "materials": [material.name for material in db_item.materials],
-        "size": db_item.size,
-        "purchase_date": db_item.purchase_date,
-        "purchase_price": db_item.purchase_price,
-        "condition": db_item.condition,
-        "description": db_item.description,
-        "season": db_item.season,
-        "is_second_hand": db_item.is_second_hand,
-        "pattern": db_item.pattern,
-        "images": [image.filename for image in db_item.images],
-        "created_at": db_item.created_at,
-        "updated_at": db_item.updated_at
-    }
+    item_dict = item_to_dict(db_item, upload_dir)
     
     return item_dict
 
 @app.put("/items/{item_id}", response_model=ItemResponse)
-def update_item(item_id: int, updated_item: ItemBase, db: Session = Depends(get_db)):
+def update_item(item_id: int, updated_item: ItemBase, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
     # Get existing item
     db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
     if not db_item:
@@ -215,6 +316,8 @@ def update_item(item_id: int, updated_item: ItemBase, db: Session = Depends(get_
     db_item.season = updated_item.season
     db_item.is_second_hand = updated_item.is_second_hand
     db_item.pattern = updated_item.pattern
+    if updated_item.status is not None:
+        db_item.status = updated_item.status
     
     # Update colors
     db_item.colors = []  # Remove existing colors
@@ -240,30 +343,12 @@ def update_item(item_id: int, updated_item: ItemBase, db: Session = Depends(get_
     db.refresh(db_item)
     
     # Convert to response model
-    item_dict = {
-        "id": db_item.id,
-        "brand": db_item.brand,
-        "name": db_item.name,
-        "category": db_item.category,
-        "colors": [color.name for color in db_item.colors],
-        "materials": [material.name for material in db_item.materials],
-        "size": db_item.size,
-        "purchase_date": db_item.purchase_date,
-        "purchase_price": db_item.purchase_price,
-        "condition": db_item.condition,
-        "description": db_item.description,
-        "season": db_item.season,
-        "is_second_hand": db_item.is_second_hand,
-        "pattern": db_item.pattern,
-        "images": [image.filename for image in db_item.images],
-        "created_at": db_item.created_at,
-        "updated_at": db_item.updated_at
-    }
+    item_dict = item_to_dict(db_item, upload_dir)
     
     return item_dict
 
 @app.delete("/items/{item_id}")
-def delete_item(item_id: int, db: Session = Depends(get_db)):
+def delete_item(item_id: int, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
     # Get existing item
     db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
     if not db_item:
@@ -272,7 +357,7 @@ def delete_item(item_id: int, db: Session = Depends(get_db)):
     # Delete associated images from filesystem
     for image in db_item.images:
         try:
-            os.remove(os.path.join(UPLOAD_DIR, image.filename))
+            os.remove(os.path.join(upload_dir, image.filename))
         except Exception as e:
             # Log error but continue with deletion
             print(f"Error removing image file: {e}")
@@ -284,7 +369,18 @@ def delete_item(item_id: int, db: Session = Depends(get_db)):
     return {"message": "Item deleted successfully"}
 
 @app.post("/items/{item_id}/images")
-async def upload_image(item_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_image(
+    item_id: int,
+    file: UploadFile = File(...),
+    extract_colors: bool = False,
+    db: Session = Depends(get_db),
+    upload_dir: str = Depends(get_upload_dir)
+):
+    """
+    Upload a photo for an item.
+    
+    extract_colors: Add the photo's dominant colours to the item, with confidence scores
+    """
     # Check if item exists
     db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
     if not db_item:
@@ -293,7 +389,7 @@ async def upload_image(item_id: int, file: UploadFile = File(...), db: Session =
     # Generate unique filename
     file_extension = os.path.splitext(file.filename)[1]
     unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    file_path = os.path.join(upload_dir, unique_filename)
     
     # Save file
     with open(file_path, "wb") as buffer:
@@ -302,20 +398,53 @@ async def upload_image(item_id: int, file: UploadFile = File(...), db: Session =
     # Create image record
     db_image = DBImage(
         item_id=item_id,
-        filename=unique_filename
+        filename=unique_filename,
+        phash=compute_phash(file_path)
     )
     db.add(db_image)
+    
+    # Only files Pillow could hash are images worth analysing
+    extracted_colors = []
+    if extract_colors and db_image.phash:
+        found = safe_dominant_colors(file_path)
+        extracted_colors = [
+            {"name": name, "confidence": confidence}
+            for name, confidence in apply_extracted_colors(db, db_item, db_image, found)
+        ]
     db.commit()
     
-    return {"filename": unique_filename}
+    return {"filename": image_path(unique_filename, upload_dir), "extracted_colors": extracted_colors}
 
-@app.delete("/items/{item_id}/images/{image_filename}")
-def delete_image(item_id: int, image_filename: str, db: Session = Depends(get_db)):
+@app.get("/items/{item_id}/colors", response_model=List[ItemColorResponse])
+def get_item_colors(item_id: int, db: Session = Depends(get_db)):
+    """List an item's colours; confidence is set for colours extracted from photos."""
+    db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    rows = (
+        db.query(DBColor.name, item_colors.c.confidence)
+        .join(item_colors, item_colors.c.color_id == DBColor.id)
+        .filter(item_colors.c.item_id == item_id)
+        .all()
+    )
+    return [{"name": name, "confidence": confidence} for name, confidence in rows]
+
+@app.delete("/items/{item_id}/images/{image_filename:path}")
+def delete_image(
+    item_id: int,
+    image_filename: str,
+    db: Session = Depends(get_db),
+    upload_dir: str = Depends(get_upload_dir)
+):
     # Get existing item
     db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
+    # Accept the path returned by the API as well as the bare filename
+    image_filename = os.path.basename(image_filename)
+    
     # Find the image in the database
     db_image = db.query(DBImage).filter(
         DBImage.item_id == item_id,
@@ -327,7 +456,7 @@ def delete_image(item_id: int, image_filename: str, db: Session = Depends(get_db
     
     # Delete the image file from filesystem
     try:
-        os.remove(os.path.join(UPLOAD_DIR, image_filename))
+        os.remove(os.path.join(upload_dir, image_filename))
     except Exception as e:
         # Log error but continue with deletion
         print(f"Error removing image file: {e}")
@@ -338,39 +467,13 @@ def delete_image(item_id: int, image_filename: str, db: Session = Depends(get_db
     
     return {"message": "Image deleted successfully"}
 
-@app.get("/export")
-def export_items(fields: str = Query(...), db: Session = Depends(get_db)):
-    """
-    Export items to CSV with selected fields.
-    
-    fields: Comma-separated list of fields to include in the export
-    """
-    selected_fields = fields.split(',')
-    
-    # Get all items from database
-    db_items = db.query(DBItem).all()
-    
-    # Check if we need to include image URLs or files
-    include_image_urls = 'include_image_urls' in selected_fields
-    include_image_files = 'include_image_files' in selected_fields
-    
-    # Remove special fields from the regular field list
-    if include_image_urls:
-        selected_fields.remove('include_image_urls')
-    if include_image_files:
-        selected_fields.remove('include_image_files')
-    
-    # Create CSV file in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header row
+def export_rows(db_items, selected_fields, include_image_urls, upload_dir=UPLOAD_DIR):
+    """Yield the header row followed by one row per item."""
     header_row = selected_fields.copy()
     if include_image_urls:
         header_row.append('image_urls')
-    writer.writerow(header_row)
+    yield header_row
     
-    # Write data rows
     for item in db_items:
         row = []
         
@@ -392,71 +495,159 @@ def export_items(fields: str = Query(...), db: Session = Depends(get_db)):
         
         # Add image URLs if requested
         if include_image_urls:
-            image_urls = [f"{UPLOAD_DIR}/{image.filename}" for image in item.images]
+            image_urls = [f"{upload_dir}/{image.filename}" for image in item.images]
             row.append(';'.join(image_urls))
         
-        writer.writerow(row)
+        yield row
+
+@app.get("/images/{image_filename:path}/duplicates", response_model=List[SimilarImageResponse])
+def get_duplicate_images(
+    image_filename: str,
+    max_distance: int = Query(4, ge=0, le=64),
+    db: Session = Depends(get_db),
+    upload_dir: str = Depends(get_upload_dir)
+):
+    """
+    Find images that look the same as the given one.
     
-    # Get CSV as string
-    output.seek(0)
-    csv_data = output.getvalue()
+    max_distance: Number of differing perceptual-hash bits still counted as a match
+    """
+    db_image = db.query(DBImage).filter(DBImage.filename == os.path.basename(image_filename)).first()
+    if not db_image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not db_image.phash:
+        raise HTTPException(status_code=400, detail="Image has no perceptual hash")
+    
+    index = get_hash_index(db)
+    matches = index.similar_images(str_to_hash(db_image.phash), max_distance)
+    return [
+        {"filename": image_path(filename, upload_dir), "item_id": item_id, "distance": distance}
+        for distance, image_id, item_id, filename in matches
+        if image_id != db_image.id
+    ]
+
+@app.get("/items/{item_id}/similar", response_model=List[SimilarItemResponse])
+def get_similar_items(
+    item_id: int,
+    max_distance: int = Query(10, ge=0, le=64),
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    """
+    Find other items whose photos look like this item's photos, closest first.
+    
+    max_distance: Number of differing perceptual-hash bits still counted as a match
+    """
+    db_item = db.query(DBItem).filter(DBItem.id == item_id).first()
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    index = get_hash_index(db)
+    closest = {}
+    for image in db_item.images:
+        if not image.phash:
+            continue
+        for distance, _, other_item_id, _ in index.similar_images(str_to_hash(image.phash), max_distance):
+            if other_item_id != item_id and distance < closest.get(other_item_id, max_distance + 1):
+                closest[other_item_id] = distance
+    
+    ranked = sorted(closest.items(), key=lambda pair: (pair[1], pair[0]))[:limit]
+    return [{"item_id": other_item_id, "distance": distance} for other_item_id, distance in ranked]
+
+@app.get("/export")
+def export_items(
+    fields: str = Query(...),
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+    upload_dir: str = Depends(get_upload_dir)
+):
+    """
+    Export items to CSV or Excel with selected fields.
+    
+    fields: Comma-separated list of fields to include in the export
+    format: 'csv' (default) or 'xlsx'
+    include_archived: Also export archived, donated and sold items
+    """
+    selected_fields = fields.split(',')
+    
+    # Stream items from the database in batches instead of loading them all
+    query = db.query(DBItem).options(
+        selectinload(DBItem.colors), selectinload(DBItem.materials), selectinload(DBItem.images)
+    )
+    if not include_archived:
+        query = query.filter(DBItem.status == "active")
+    db_items = query.order_by(DBItem.id).yield_per(500)
+    
+    # Check if we need to include image URLs or files
+    include_image_urls = 'include_image_urls' in selected_fields
+    include_image_files = 'include_image_files' in selected_fields
+    
+    # Remove special fields from the regular field list
+    if include_image_urls:
+        selected_fields.remove('include_image_urls')
+    if include_image_files:
+        selected_fields.remove('include_image_files')
+    
+    # Write the export to a temporary file that spills to disk when large
+    export_file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    write_table(export_rows(db_items, selected_fields, include_image_urls, upload_dir), export_file, format)
+    export_filename = f"capsulib_export.{format}"
     
     # If we're including image files, create a ZIP file
     if include_image_files:
-        # Create a ZIP file in memory
-        zip_buffer = io.BytesIO()
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Add CSV file to ZIP
-            zip_file.writestr('capsulib_export.csv', csv_data)
+            # Add the export file to the ZIP
+            export_file.seek(0)
+            with zip_file.open(export_filename, 'w') as entry:
+                shutil.copyfileobj(export_file, entry)
+            export_file.close()
             
             # Add all images to ZIP
-            for item in db_items:
-                for image in item.images:
-                    image_path = os.path.join(UPLOAD_DIR, image.filename)
-                    if os.path.exists(image_path):
-                        with open(image_path, 'rb') as img_file:
-                            zip_file.writestr(f"images/{image.filename}", img_file.read())
+            images = db.query(DBImage.filename).join(DBItem, DBImage.item_id == DBItem.id)
+            if not include_archived:
+                images = images.filter(DBItem.status == "active")
+            for (filename,) in images.yield_per(1000):
+                image_path = os.path.join(upload_dir, filename)
+                if os.path.exists(image_path):
+                    zip_file.write(image_path, f"images/{filename}")
         
         # Return ZIP file
-        zip_buffer.seek(0)
         return StreamingResponse(
-            zip_buffer, 
+            iter_file(zip_buffer), 
             media_type="application/zip",
             headers={"Content-Disposition": f"attachment; filename=capsulib_export.zip"}
         )
     
-    # Return CSV file
+    # Return export file
     return StreamingResponse(
-        io.StringIO(csv_data),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=capsulib_export.csv"}
+        iter_file(export_file),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={export_filename}"}
     )
 
 @app.post("/items/import/preview", response_model=ImportPreviewResponse)
 async def preview_import(file: UploadFile = File(...)):
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="File must be a CSV")
+    fmt = file_format(file.filename)
+    if not fmt:
+        raise HTTPException(status_code=400, detail="File must be a CSV or Excel (.xlsx) file")
     
     try:
-        contents = await file.read()
-        csv_file = io.StringIO(contents.decode('utf-8'))
-        csv_reader = csv.DictReader(csv_file)
-        
-        # Get headers
-        headers = csv_reader.fieldnames or []
+        headers, rows = read_table(file.file, fmt)
         
         # Get preview rows (first 5 rows)
-        preview_rows = []
-        for i, row in enumerate(csv_reader):
-            if i >= 5:  # Only show first 5 rows
-                break
-            preview_rows.append([row.get(header, '') for header in headers])
+        sample, _ = sample_rows(rows)
+        preview_rows = [[row.get(header, '') for header in headers] for row in sample[:5]]
+        
+        # Report the types the importer will detect for each column
+        detected_types = {header: describe_column(column_values(sample, header)) for header in headers}
         
         # Define available fields in our system
         available_fields = [
             'name', 'brand', 'category', 'size', 'colors', 'materials',
             'pattern', 'season', 'condition', 'purchase_date', 'purchase_price',
-            'description', 'is_second_hand'
+            'description', 'is_second_hand', 'status'
         ]
         
         # Define required fields
@@ -465,11 +656,12 @@ async def preview_import(file: UploadFile = File(...)):
         return {
             "headers": headers,
             "preview_rows": preview_rows,
+            "detected_types": detected_types,
             "available_fields": available_fields,
             "required_fields": required_fields
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing CSV: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
 
 @app.post("/items/import")
 async def import_items(
@@ -477,79 +669,38 @@ async def import_items(
     mappings: str = Form(...),  # JSON string of column mappings
     db: Session = Depends(get_db)
 ):
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="File must be a CSV")
+    fmt = file_format(file.filename)
+    if not fmt:
+        raise HTTPException(status_code=400, detail="File must be a CSV or Excel (.xlsx) file")
     
     try:
         # Parse mappings from JSON string
         column_mappings = json.loads(mappings)
         
-        contents = await file.read()
-        csv_file = io.StringIO(contents.decode('utf-8'))
-        csv_reader = csv.DictReader(csv_file)
+        _, rows = read_table(file.file, fmt)
+        
+        # Infer each column's formats once and compile its converter
+        sample, rows = sample_rows(rows)
+        plan = ImportPlan(column_mappings, sample)
         
         imported_count = 0
         updated_count = 0
         skipped_count = 0
         
-        for row in csv_reader:
-            # Skip rows that only have an ID or are empty
-            has_content = False
-            for csv_column, field_name in column_mappings.items():
-                if field_name and csv_column in row and row[csv_column].strip():
-                    has_content = True
-                    break
-            
-            if not has_content:
-                skipped_count += 1
-                continue
-            
+        for row in rows:
             # Create item data using the mappings
-            item_data = {}
-            for csv_column, field_name in column_mappings.items():
-                if field_name and csv_column in row:
-                    value = row[csv_column].strip()
-                    
-                    # Skip if the value is empty
-                    if not value:
-                        continue
-                    
-                    # Process special fields
-                    if field_name == 'purchase_date' and value:
-                        try:
-                            # Try different date formats
-                            try:
-                                value = datetime.strptime(value, '%Y-%m-%d')
-                            except ValueError:
-                                try:
-                                    value = datetime.strptime(value, '%m/%d/%Y')
-                                except ValueError:
-                                    value = datetime.strptime(value, '%d/%m/%Y')
-                        except ValueError:
-                            value = None
-                    
-                    elif field_name == 'purchase_price' and value:
-                        # Remove currency and convert comma to dot
-                        value = value.replace('EUR', '').replace(',', '.').strip()
-                    
-                    elif field_name == 'colors' and value:
-                        # Split by comma or semicolon
-                        value = [c.strip() for c in value.replace(';', ',').split(',') if c.strip()]
-                    
-                    elif field_name == 'materials' and value:
-                        # Split by comma or semicolon
-                        value = [m.strip() for m in value.replace(';', ',').split(',') if m.strip()]
-                    
-                    elif field_name == 'is_second_hand' and value:
-                        value = value.lower() in ['true', 'second-hand', 'secondhand', 'used']
-                    
-                    item_data[field_name] = value
+            item_data = plan.convert(row)
             
-            # Skip if no name is provided
+            # Skip empty rows and rows without a name
             if not item_data.get('name'):
                 skipped_count += 1
                 continue
             
+            # Unknown statuses fall back to active
+            if 'status' in item_data:
+                status = item_data['status'].lower()
+                item_data['status'] = status if status in ITEM_STATUSES else 'active'
+            
             # Check if item with same name exists
             existing_item = db.query(DBItem).filter(DBItem.name == item_data['name']).first()
             
@@ -594,7 +745,8 @@ async def import_items(
                     description=item_data.get('description'),
                     season=item_data.get('season'),
                     is_second_hand=item_data.get('is_second_hand', False),
-                    pattern=item_data.get('pattern')
+                    pattern=item_data.get('pattern'),
+                    status=item_data.get('status', 'active')
                 )
                 
                 # Add colors only if mapped
@@ -633,17 +785,21 @@ async def import_items(
         raise HTTPException(status_code=400, detail=f"Error importing items: {str(e)}")
 
 @app.delete("/items")
-def delete_all_items(db: Session = Depends(get_db)):
+def delete_all_items(db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
     try:
         # Delete all images from filesystem
         db_images = db.query(DBImage).all()
         for image in db_images:
             try:
-                os.remove(os.path.join(UPLOAD_DIR, image.filename))
+                os.remove(os.path.join(upload_dir, image.filename))
             except Exception as e:
                 # Log error but continue with deletion
                 print(f"Error removing image file: {e}")
         
+        # Bulk deletes bypass the session, so write the tombstones ourselves
+        item_ids = [item_id for (item_id,) in db.query(DBItem.id).all()]
+        record_item_changes(db.connection(), item_ids, deleted=True)
+        
         # Delete all items from database
         db.query(DBItem).delete()
         db.commit()
@@ -653,6 +809,84 @@ def delete_all_items(db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting items: {str(e)}")
 
+@app.get("/outfits", response_model=List[OutfitResponse])
+def get_outfits(
+    limit: int = Query(10, ge=1, le=100),
+    season: Optional[str] = None,
+    outerwear: bool = False,
+    max_item_use: int = Query(2, ge=1),
+    db: Session = Depends(get_db)
+):
+    """
+    Suggest the best-matching outfits from the wardrobe.
+    
+    season: Only use items worn in this season (e.g. 'summer')
+    outerwear: Add a jacket or coat to every outfit
+    max_item_use: How many of the returned outfits may share an item
+    """
+    slots = get_slot_features(db, season)
+    return recommend_outfits(slots, limit=limit, include_outerwear=outerwear, max_item_use=max_item_use)
+
+@app.get("/outfits/capsule", response_model=CapsuleResponse)
+def get_capsule(
+    days: int = Query(7, ge=1, le=365),
+    season: Optional[str] = None,
+    min_score: float = 4.0,
+    db: Session = Depends(get_db)
+):
+    """
+    Pick a minimal set of items that can be combined into `days` good outfits.
+    
+    season: Only use items worn in this season (e.g. 'winter')
+    min_score: Lowest outfit score that still counts as a good outfit
+    """
+    slots = get_slot_features(db, season)
+    item_ids, outfits = build_capsule(slots, days=days, min_score=min_score)
+    return {"items": item_ids, "outfits": outfits}
+
+def marketplace_provider(provider: str):
+    marketplace = get_provider(provider)
+    if marketplace is None:
+        raise HTTPException(status_code=404, detail=f"Unknown marketplace: {provider}")
+    if not marketplace.configured:
+        raise HTTPException(status_code=400, detail=f"Set CAPSULIB_{provider.upper()}_URL to use {provider}")
+    return marketplace
+
+@app.post("/marketplaces/{provider}/listings")
+def publish_listings(provider: str, request: PublishListingsRequest, db: Session = Depends(get_db)):
+    """Queue items for listing on a marketplace; they are sent on the next sync."""
+    queued = publish_items(db, marketplace_provider(provider), request.item_ids)
+    return {"queued": queued}
+
+@app.get("/marketplaces/{provider}/listings", response_model=List[MarketplaceListingResponse])
+def get_listings(provider: str, state: Optional[str] = None, db: Session = Depends(get_db)):
+    query = db.query(DBMarketplaceListing).filter(DBMarketplaceListing.provider == provider)
+    if state:
+        query = query.filter(DBMarketplaceListing.state == state)
+    return query.order_by(DBMarketplaceListing.item_id).all()
+
+@app.delete("/marketplaces/{provider}/listings/{item_id}")
+def delete_listing(provider: str, item_id: int, db: Session = Depends(get_db)):
+    """Queue an item's listing for removal from a marketplace."""
+    if not unpublish_item(db, marketplace_provider(provider), item_id):
+        raise HTTPException(status_code=404, detail="Item is not listed on this marketplace")
+    return {"message": "Listing will be removed on the next sync"}
+
+@app.post("/marketplaces/{provider}/sync")
+async def sync_listings(provider: str, db: Session = Depends(get_db), upload_dir: str = Depends(get_upload_dir)):
+    """
+    Push queued and changed listings to a marketplace.
+
+    Returns how many listings were published, delisted, failed or skipped as
+    unchanged, plus the number of listings in each state afterwards.
+    """
+    marketplace = marketplace_provider(provider)
+    try:
+        stats = await sync_marketplace(db, marketplace, image_base_url=f"{PUBLIC_URL}/{upload_dir}")
+    except MarketplaceError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**stats, "listings": listing_counts(db, marketplace)}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
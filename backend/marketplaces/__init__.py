@@ -0,0 +1,48 @@
+"""
+Outbound listing sync to second-hand marketplaces.
+
+Each provider is configured through the environment (CAPSULIB_<NAME>_URL,
+CAPSULIB_<NAME>_TOKEN) and shares one pooled HTTP client. See sync.py for
+how listings follow the item change feed, and mock_server.py for a local
+marketplace to test against.
+"""
+from .base import MarketplaceProvider
+from .client import MarketplaceError, close_http_client, get_http_client
+
+class MockMarketplace(MarketplaceProvider):
+    name = "mock"
+    default_url = "http://localhost:8100"
+    requests_per_second = 50.0
+    burst = 10
+    max_concurrency = 8
+
+class Vinted(MarketplaceProvider):
+    name = "vinted"
+    requests_per_second = 2.0
+    burst = 2
+
+class Ebay(MarketplaceProvider):
+    name = "ebay"
+    requests_per_second = 5.0
+    burst = 5
+    # The Inventory API's bulk calls take at most 25 items
+    batch_size = 25
+
+class Marktplaats(MarketplaceProvider):
+    name = "marktplaats"
+    requests_per_second = 2.0
+    burst = 2
+
+PROVIDER_CLASSES = {cls.name: cls for cls in (MockMarketplace, Vinted, Ebay, Marktplaats)}
+
+# Providers hold their rate limiter, so keep one instance per process
+_providers = {}
+
+def get_provider(name):
+    """Return the provider instance for a name, or None if unknown."""
+    cls = PROVIDER_CLASSES.get(name)
+    if cls is None:
+        return None
+    if name not in _providers:
+        _providers[name] = cls()
+    return _providers[name]
@@ -0,0 +1,90 @@
+"""
+Provider base class: what a listing looks like and how batches are sent.
+"""
+import hashlib
+import json
+import os
+
+from .client import MarketplaceError, RateLimiter, send
+
+class MarketplaceProvider:
+    """
+    One marketplace. Subclasses set the name and the limits the marketplace
+    enforces; the endpoint and token come from CAPSULIB_<NAME>_URL and
+    CAPSULIB_<NAME>_TOKEN.
+
+    The default publish()/delete() speak the batch contract of the mock
+    server (POST {base_url}/listings/batch and /listings/batch-delete with
+    per-listing results). Providers whose API differs override them and
+    keep the same return shape: {reference: (external id, error)}.
+    """
+    name = None
+    default_url = None
+    # Sustained requests per second and the burst allowed on top
+    requests_per_second = 2.0
+    burst = 2
+    batch_size = 50
+    # Batches in flight at once; the rate limiter still bounds requests/s
+    max_concurrency = 4
+    max_retries = 5
+
+    def __init__(self):
+        prefix = f"CAPSULIB_{self.name.upper()}"
+        self.base_url = os.getenv(f"{prefix}_URL", self.default_url or "").rstrip("/")
+        self.token = os.getenv(f"{prefix}_TOKEN")
+        self.limiter = RateLimiter(self.requests_per_second, self.burst)
+
+    @property
+    def configured(self):
+        return bool(self.base_url)
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def listing_payload(self, item, image_urls):
+        return {
+            "reference": str(item.id),
+            "title": " ".join(part for part in (item.brand, item.name) if part),
+            "description": item.description or "",
+            "category": item.category,
+            "size": item.size,
+            "condition": item.condition,
+            "colors": sorted(color.name for color in item.colors),
+            "materials": sorted(material.name for material in item.materials),
+            "price": item.purchase_price,
+            "images": image_urls,
+        }
+
+    @staticmethod
+    def content_hash(payload):
+        """Stable digest of a payload, so unchanged listings aren't re-sent."""
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def publish(self, client, payloads):
+        """Create or update listings. Returns {reference: (external id, error)}."""
+        response = await send(
+            client, self.limiter, "POST", f"{self.base_url}/listings/batch",
+            max_retries=self.max_retries, headers=self.headers(), json={"listings": payloads},
+        )
+        try:
+            return {
+                result["reference"]: (result.get("id"), result.get("error"))
+                for result in response.json()["results"]
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise self._malformed(response, e)
+
+    async def delete(self, client, external_ids):
+        """Remove listings. Returns {external id: error or None}."""
+        response = await send(
+            client, self.limiter, "POST", f"{self.base_url}/listings/batch-delete",
+            max_retries=self.max_retries, headers=self.headers(), json={"ids": external_ids},
+        )
+        try:
+            return {result["id"]: result.get("error") for result in response.json()["results"]}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise self._malformed(response, e)
+
+    def _malformed(self, response, error):
+        # A 2xx body we can't read fails the batch like an HTTP error would
+        return MarketplaceError(f"Malformed response from {self.name} ({type(error).__name__}): {response.text[:200]}")
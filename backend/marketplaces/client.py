@@ -0,0 +1,105 @@
+"""
+Shared HTTP plumbing for marketplace providers: one pooled client,
+per-provider rate limiting and retries with exponential backoff.
+"""
+import asyncio
+import random
+import time
+
+import httpx
+
+# Retried with backoff; other 4xx responses fail immediately
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+class MarketplaceError(Exception):
+    pass
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` requests per second with bursts of `burst`.
+
+    A 429's Retry-After is honoured by draining the bucket, which holds back
+    every request to that provider, not just the one that was rejected.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = None
+        self.loop = None
+
+    async def acquire(self):
+        # asyncio locks belong to one event loop; the CLI and tests may run several
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.lock, self.loop = asyncio.Lock(), loop
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+_client = None
+
+def get_http_client():
+    """Return the process-wide pooled HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return max(float(value), 0.0) if value else None
+    except ValueError:
+        return None
+
+async def send(client, limiter, method, url, max_retries=5, **kwargs):
+    """
+    Send a request within the provider's rate limit, retrying transient failures.
+
+    Returns the response for any 2xx; raises MarketplaceError otherwise.
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        delay = None
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if response.is_success:
+                return response
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if response.status_code not in RETRY_STATUSES:
+                raise MarketplaceError(error)
+            delay = _retry_after(response)
+            if delay is not None and response.status_code == 429:
+                limiter.pause(delay)
+        if attempt == max_retries:
+            break
+        if delay is None:
+            # Full jitter keeps many concurrent batches from retrying in lockstep
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+        await asyncio.sleep(delay)
+    raise MarketplaceError(f"Giving up after {max_retries + 1} attempts: {error}")
@@ -0,0 +1,100 @@
+"""
+A local marketplace speaking the batch contract of MarketplaceProvider, for
+testing sync throughput and failure handling offline:
+
+    uvicorn marketplaces.mock_server:app --port 8100
+
+Then sync against it with `python -m marketplaces.sync mock --publish-all`.
+Misbehaviour is configured through the environment:
+
+    MOCK_LATENCY_MS     added to every request (default 50)
+    MOCK_FAILURE_RATE   share of requests answered with a 503 (default 0)
+    MOCK_RATE_LIMIT     requests per second before answering 429 (default: no limit)
+    MOCK_REJECT_RATE    share of listings rejected individually (default 0)
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+from typing import Dict, List
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "50"))
+FAILURE_RATE = float(os.getenv("MOCK_FAILURE_RATE", "0"))
+RATE_LIMIT = float(os.getenv("MOCK_RATE_LIMIT", "0"))
+REJECT_RATE = float(os.getenv("MOCK_REJECT_RATE", "0"))
+MAX_BATCH = 100
+
+app = FastAPI(title="Mock marketplace")
+
+listings: Dict[str, dict] = {}
+references: Dict[str, str] = {}  # our reference -> listing id
+request_times: List[float] = []
+counters = {"requests": 0, "rate_limited": 0, "failed": 0}
+
+class ListingBatch(BaseModel):
+    listings: List[dict]
+
+class DeleteBatch(BaseModel):
+    ids: List[str]
+
+async def misbehave():
+    """Return an error response to send instead of handling the request, if any."""
+    counters["requests"] += 1
+    now = time.monotonic()
+    if RATE_LIMIT:
+        while request_times and request_times[0] < now - 1:
+            request_times.pop(0)
+        if len(request_times) >= RATE_LIMIT:
+            counters["rate_limited"] += 1
+            retry_after = max(request_times[0] + 1 - now, 0.1)
+            return JSONResponse({"error": "Rate limit exceeded"}, status_code=429, headers={"Retry-After": f"{retry_after:.2f}"})
+        request_times.append(now)
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if random.random() < FAILURE_RATE:
+        counters["failed"] += 1
+        return JSONResponse({"error": "Service unavailable"}, status_code=503)
+    return None
+
+@app.post("/listings/batch")
+async def publish(batch: ListingBatch):
+    error = await misbehave()
+    if error is not None:
+        return error
+    if len(batch.listings) > MAX_BATCH:
+        return JSONResponse({"error": f"At most {MAX_BATCH} listings per batch"}, status_code=413)
+    results = []
+    for listing in batch.listings:
+        reference = listing.get("reference")
+        if not reference or not listing.get("title"):
+            results.append({"reference": reference, "error": "reference and title are required"})
+        elif random.random() < REJECT_RATE:
+            results.append({"reference": reference, "error": "Listing rejected by moderation"})
+        else:
+            listing_id = references.get(reference) or uuid.uuid4().hex[:12]
+            references[reference] = listing_id
+            listings[listing_id] = listing
+            results.append({"reference": reference, "id": listing_id})
+    return {"results": results}
+
+@app.post("/listings/batch-delete")
+async def delete(batch: DeleteBatch):
+    error = await misbehave()
+    if error is not None:
+        return error
+    results = []
+    for listing_id in batch.ids:
+        # Deleting a listing that is already gone succeeds, so retries are safe
+        listing = listings.pop(listing_id, None)
+        if listing is not None:
+            references.pop(listing.get("reference"), None)
+        results.append({"id": listing_id})
+    return {"results": results}
+
+@app.get("/listings")
+def get_listings():
+    return {"count": len(listings), "stats": counters, "listings": listings}
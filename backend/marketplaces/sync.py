@@ -0,0 +1,320 @@
+"""
+Listing sync: keeps each marketplace in step with the wardrobe.
+
+Items are put on a marketplace with publish_items(), which queues them as
+"pending". sync() then
+
+1. follows the item change feed from the provider's saved cursor, queueing
+   a refresh for edited listings and a delisting for items that were
+   deleted or are no longer active;
+2. sends pending listings in batches, several in flight at once within the
+   provider's rate limit, skipping listings whose content hasn't changed;
+3. sends pending delistings the same way.
+
+Every page of the feed and every batch is committed as soon as it is done,
+so an interrupted sync picks up where it stopped. Listings that keep
+failing are retried on later syncs until MAX_ATTEMPTS, then left "failed".
+
+Run a sync from the command line with:
+
+    python -m marketplaces.sync <provider> [--publish-all] [--user USER]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import time
+
+import httpx
+from sqlalchemy import delete, func, update
+from sqlalchemy.orm import selectinload
+
+from database import Item, ItemChange, MarketplaceListing, MarketplaceSyncState
+
+from .client import MarketplaceError, get_http_client
+
+MAX_ATTEMPTS = 5
+FEED_PAGE_SIZE = 500
+PUBLIC_URL = os.getenv("CAPSULIB_PUBLIC_URL", "http://localhost:8000").rstrip("/")
+
+# (database URL, provider) pairs with a sync under way in this process
+_running = set()
+
+def _sync_state(db, provider):
+    state = db.get(MarketplaceSyncState, provider.name)
+    if state is None:
+        # Listings are queued with the item's current content, so earlier
+        # changes in the feed are already accounted for
+        cursor = db.query(func.max(ItemChange.seq)).scalar() or 0
+        state = MarketplaceSyncState(provider=provider.name, cursor=cursor)
+        db.add(state)
+        db.flush()
+    return state
+
+def publish_items(db, provider, item_ids):
+    """
+    Queue active items for listing on a marketplace. Returns the number queued.
+
+    Items already listed or queued are left alone; delisted and failed ones
+    are queued again.
+    """
+    _sync_state(db, provider)
+    active_ids = {
+        item_id for (item_id,) in
+        db.query(Item.id).filter(Item.id.in_(set(item_ids)), Item.status == "active")
+    }
+    listings = {
+        listing.item_id: listing for listing in
+        db.query(MarketplaceListing).filter(
+            MarketplaceListing.provider == provider.name, MarketplaceListing.item_id.in_(active_ids)
+        )
+    }
+    queued = 0
+    for item_id in sorted(active_ids):
+        listing = listings.get(item_id)
+        if listing is None:
+            db.add(MarketplaceListing(provider=provider.name, item_id=item_id))
+        elif listing.state in ("listed", "pending"):
+            continue
+        else:
+            listing.state = "pending"
+            listing.attempts = 0
+            listing.last_error = None
+        queued += 1
+    db.commit()
+    return queued
+
+def unpublish_item(db, provider, item_id):
+    """Queue an item's listing for removal. Returns False if it isn't on the marketplace."""
+    listing = db.query(MarketplaceListing).filter(
+        MarketplaceListing.provider == provider.name, MarketplaceListing.item_id == item_id
+    ).first()
+    if listing is None or listing.state == "delisted":
+        return False
+    _withdraw(listing)
+    db.commit()
+    return True
+
+def _withdraw(listing):
+    listing.attempts = 0
+    listing.last_error = None
+    listing.state = "pending_delete" if listing.external_id else "delisted"
+
+def follow_changes(db, provider):
+    """Fold item changes since the provider's cursor into its listings. Returns the listings touched."""
+    state = _sync_state(db, provider)
+    touched = 0
+    while True:
+        changes = (
+            db.query(ItemChange)
+            .filter(ItemChange.seq > state.cursor)
+            .order_by(ItemChange.seq)
+            .limit(FEED_PAGE_SIZE)
+            .all()
+        )
+        if not changes:
+            break
+        item_ids = [change.item_id for change in changes]
+        listings = {
+            listing.item_id: listing for listing in
+            db.query(MarketplaceListing).filter(
+                MarketplaceListing.provider == provider.name, MarketplaceListing.item_id.in_(item_ids)
+            )
+        }
+        statuses = dict(db.query(Item.id, Item.status).filter(Item.id.in_(listings)))
+        for change in changes:
+            listing = listings.get(change.item_id)
+            # Only items that were published follow the feed; a withdrawn
+            # listing stays withdrawn until the item is published again
+            if listing is None or listing.state in ("pending_delete", "delisted"):
+                continue
+            if change.deleted or statuses.get(change.item_id) != "active":
+                _withdraw(listing)
+            elif listing.state != "pending":
+                listing.state = "pending"
+                listing.attempts = 0
+            touched += 1
+        state.cursor = changes[-1].seq
+        db.commit()
+    return touched
+
+def _failure(listing_id, attempts, error, retry_state):
+    attempts += 1
+    return {
+        "id": listing_id,
+        "attempts": attempts,
+        "last_error": str(error)[:500],
+        "state": "failed" if attempts >= MAX_ATTEMPTS else retry_state,
+    }
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def _save_results(db, updates, removed=()):
+    # Bulk UPDATE by primary key: one executemany per batch instead of
+    # reloading and flushing every listing the commit expired
+    if updates:
+        db.execute(update(MarketplaceListing), updates)
+    if removed:
+        db.execute(delete(MarketplaceListing).where(MarketplaceListing.id.in_(removed)))
+    db.commit()
+
+async def push_listings(db, provider, client, image_base_url, stats):
+    """Publish or refresh every pending listing."""
+    pending = db.query(MarketplaceListing).filter(
+        MarketplaceListing.provider == provider.name, MarketplaceListing.state == "pending"
+    ).order_by(MarketplaceListing.id).all()
+    if not pending:
+        return
+
+    # Build payloads up front, keeping plain values only; the sends below
+    # then only write their results back
+    work = []
+    for rows in _batches(pending, 500):
+        items = {
+            item.id: item for item in
+            db.query(Item)
+            .options(selectinload(Item.colors), selectinload(Item.materials), selectinload(Item.images))
+            .filter(Item.id.in_([listing.item_id for listing in rows]))
+        }
+        for listing in rows:
+            item = items.get(listing.item_id)
+            if item is None or item.status != "active":
+                _withdraw(listing)
+                continue
+            payload = provider.listing_payload(item, [f"{image_base_url}/{image.filename}" for image in item.images])
+            digest = provider.content_hash(payload)
+            if listing.external_id and digest == listing.content_hash:
+                listing.state = "listed"
+                stats["unchanged"] += 1
+                continue
+            work.append((listing.id, listing.attempts or 0, payload, digest))
+    db.commit()
+
+    semaphore = asyncio.Semaphore(provider.max_concurrency)
+
+    async def send_batch(batch):
+        async with semaphore:
+            try:
+                results = await provider.publish(client, [payload for _, _, payload, _ in batch])
+            except MarketplaceError as e:
+                results = {payload["reference"]: (None, str(e)) for _, _, payload, _ in batch}
+        now = datetime.datetime.utcnow()
+        updates = []
+        for listing_id, attempts, payload, digest in batch:
+            external_id, error = results.get(payload["reference"], (None, "Missing from the marketplace's response"))
+            if error or not external_id:
+                updates.append(_failure(listing_id, attempts, error or "No listing id returned", "pending"))
+                stats["failed"] += 1
+                continue
+            updates.append({
+                "id": listing_id, "external_id": external_id, "content_hash": digest, "state": "listed",
+                "attempts": 0, "last_error": None, "synced_at": now,
+            })
+            stats["published"] += 1
+        _save_results(db, updates)
+
+    await asyncio.gather(*(send_batch(batch) for batch in _batches(work, provider.batch_size)))
+
+async def push_deletes(db, provider, client, stats):
+    """Remove every listing queued for deletion."""
+    pending = db.query(
+        MarketplaceListing.id, MarketplaceListing.attempts, MarketplaceListing.external_id, MarketplaceListing.item_id
+    ).filter(
+        MarketplaceListing.provider == provider.name, MarketplaceListing.state == "pending_delete"
+    ).order_by(MarketplaceListing.id).all()
+    semaphore = asyncio.Semaphore(provider.max_concurrency)
+
+    async def send_batch(batch):
+        async with semaphore:
+            try:
+                results = await provider.delete(client, [external_id for _, _, external_id, _ in batch])
+            except MarketplaceError as e:
+                results = {external_id: str(e) for _, _, external_id, _ in batch}
+        now = datetime.datetime.utcnow()
+        updates = []
+        removed = []
+        for listing_id, attempts, external_id, item_id in batch:
+            error = results.get(external_id, "Missing from the marketplace's response")
+            if error:
+                updates.append(_failure(listing_id, attempts or 0, error, "pending_delete"))
+                stats["failed"] += 1
+                continue
+            stats["delisted"] += 1
+            if item_id is None:
+                # The item was deleted; nothing is left to track
+                removed.append(listing_id)
+                continue
+            updates.append({
+                "id": listing_id, "external_id": None, "content_hash": None, "state": "delisted",
+                "attempts": 0, "last_error": None, "synced_at": now,
+            })
+        _save_results(db, updates, removed)
+
+    await asyncio.gather(*(send_batch(batch) for batch in _batches(pending, provider.batch_size)))
+
+async def sync(db, provider, client=None, image_base_url=f"{PUBLIC_URL}/uploads"):
+    """
+    Bring a marketplace up to date with the wardrobe.
+
+    Returns counts of listings published, delisted, failed and skipped as
+    unchanged. Raises MarketplaceError if a sync of the same database and
+    marketplace is already running.
+    """
+    key = (str(db.get_bind().url), provider.name)
+    if key in _running:
+        raise MarketplaceError(f"A {provider.name} sync is already running")
+    _running.add(key)
+    try:
+        client = client or get_http_client()
+        stats = {"published": 0, "delisted": 0, "failed": 0, "unchanged": 0}
+        follow_changes(db, provider)
+        await push_listings(db, provider, client, image_base_url, stats)
+        await push_deletes(db, provider, client, stats)
+        return stats
+    finally:
+        _running.discard(key)
+
+def listing_counts(db, provider):
+    """Return {state: number of listings} for a marketplace."""
+    return dict(
+        db.query(MarketplaceListing.state, func.count())
+        .filter(MarketplaceListing.provider == provider.name)
+        .group_by(MarketplaceListing.state)
+    )
+
+async def _main(args):
+    from database import open_session, shard_name
+    from marketplaces import get_provider
+
+    provider = get_provider(args.provider)
+    if provider is None or not provider.configured:
+        raise SystemExit(f"Unknown or unconfigured marketplace: {args.provider}")
+    shard = shard_name(args.user) if args.user else None
+    image_base_url = f"{args.public_url.rstrip('/')}/uploads" + (f"/{shard}" if shard else "")
+    db = open_session(shard)
+    try:
+        if args.publish_all:
+            item_ids = [item_id for (item_id,) in db.query(Item.id).filter(Item.status == "active")]
+            print(f"Queued {publish_items(db, provider, item_ids)} items")
+        start = time.perf_counter()
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)) as client:
+            stats = await sync(db, provider, client, image_base_url)
+        elapsed = time.perf_counter() - start
+        done = stats["published"] + stats["delisted"]
+        print(
+            f"Published {stats['published']}, delisted {stats['delisted']}, failed {stats['failed']}, "
+            f"unchanged {stats['unchanged']} in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f} listings/s)"
+        )
+        print(f"Listings by state: {listing_counts(db, provider)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync wardrobe listings to a marketplace.")
+    parser.add_argument("provider", help="mock, vinted, ebay or marktplaats")
+    parser.add_argument("--publish-all", action="store_true", help="Queue every active item before syncing")
+    parser.add_argument("--public-url", default=PUBLIC_URL, help="Base URL marketplaces fetch images from")
+    parser.add_argument("--user", help="In multi-tenant mode, the user whose shard to sync")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,344 @@
+"""
+Outfit and capsule recommendations.
+
+Items are reduced to a small per-slot feature matrix (season bitmask, colour
+hue, neutral/pattern flags). Compatibility between every pair of slots is
+scored in one vectorized step, so candidate outfits are ranked without
+enumerating every top/bottom/shoes combination in Python.
+
+The features are cached per database and kept current from the item change
+feed: only items changed since the last request are re-read.
+"""
+import math
+import re
+import threading
+
+import numpy as np
+from sqlalchemy.orm import selectinload
+
+from database import Item, in_batches, item_changes_since, per_database
+from palette import color_hue, is_neutral
+
+SLOTS = ('top', 'bottom', 'shoes', 'outerwear')
+
+# Category keywords per slot; checked word by word against Item.category
+SLOT_KEYWORDS = {
+    'top': {'top', 'tops', 'shirt', 'shirts', 't-shirt', 'tee', 'blouse', 'sweater', 'jumper', 'knitwear',
+            'cardigan', 'hoodie', 'sweatshirt', 'polo', 'tank', 'vest'},
+    'bottom': {'bottom', 'bottoms', 'pants', 'trousers', 'jeans', 'shorts', 'skirt', 'skirts', 'chinos', 'leggings'},
+    'shoes': {'shoes', 'shoe', 'sneakers', 'trainers', 'boots', 'boot', 'sandals', 'loafers', 'heels', 'footwear'},
+    'outerwear': {'outerwear', 'jacket', 'jackets', 'coat', 'coats', 'blazer', 'parka', 'raincoat', 'overshirt'},
+}
+
+SEASONS = ('spring', 'summer', 'autumn', 'winter')
+SEASON_ALIASES = {'fall': 'autumn', 'lente': 'spring', 'zomer': 'summer', 'herfst': 'autumn'}
+ALL_SEASONS = (1 << len(SEASONS)) - 1
+
+SOLID_PATTERNS = {'', 'solid', 'plain', 'none', 'no', 'effen'}
+
+# Pair score weights
+SEASON_MATCH = 1.0
+SEASON_MISMATCH = -2.0
+NEUTRAL_MATCH = 1.0
+ANALOGOUS_MATCH = 0.8
+COMPLEMENTARY_MATCH = 0.6
+COLOR_CLASH = -0.5
+PATTERN_CLASH = -1.0
+# Outfit-level penalty per chromatic piece beyond the second
+EXTRA_COLOR_PENALTY = 0.5
+
+ANALOGOUS_COS = math.cos(math.radians(35))
+COMPLEMENTARY_COS = math.cos(math.radians(150))
+
+def category_slot(category):
+    """Return the outfit slot for an item category, or None if it doesn't fit one."""
+    words = re.split(r'[\s/,&]+', (category or '').strip().lower())
+    for slot in SLOTS:
+        if any(word in SLOT_KEYWORDS[slot] for word in words):
+            return slot
+    return None
+
+def season_mask(season):
+    """Return a bitmask of the seasons an item is worn in; unknown means all."""
+    mask = 0
+    for word in re.split(r'[^a-z]+', (season or '').lower()):
+        word = SEASON_ALIASES.get(word, word)
+        if word in SEASONS:
+            mask |= 1 << SEASONS.index(word)
+        elif word in ('all', 'any', 'year'):
+            return ALL_SEASONS
+    return mask or ALL_SEASONS
+
+def item_features(item):
+    """Return (slot, season mask, neutral, has hue, hue cos, hue sin, patterned) for an item."""
+    hue = None
+    neutral = True
+    for color in item.colors:
+        if is_neutral(color.name):
+            continue
+        neutral = False
+        hue = color_hue(color.name)
+        break
+    angle = 2 * math.pi * hue if hue is not None else 0.0
+    patterned = (item.pattern or '').strip().lower() not in SOLID_PATTERNS
+    return (
+        category_slot(item.category),
+        season_mask(item.season),
+        neutral,
+        hue is not None,
+        math.cos(angle),
+        math.sin(angle),
+        patterned,
+    )
+
+class SlotFeatures:
+    """Column-wise feature arrays for the items in one slot."""
+    def __init__(self, rows):
+        # rows: list of (item_id, features)
+        self.ids = np.array([item_id for item_id, _ in rows], dtype=np.int64)
+        columns = list(zip(*[features[1:] for _, features in rows])) or [()] * 6
+        self.season = np.array(columns[0], dtype=np.uint8)
+        self.neutral = np.array(columns[1], dtype=bool)
+        self.has_hue = np.array(columns[2], dtype=bool)
+        self.hue = np.stack([np.array(columns[3], dtype=np.float32), np.array(columns[4], dtype=np.float32)], axis=1)
+        self.patterned = np.array(columns[5], dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, mask):
+        subset = SlotFeatures.__new__(SlotFeatures)
+        for name in ('ids', 'season', 'neutral', 'has_hue', 'hue', 'patterned'):
+            setattr(subset, name, getattr(self, name)[mask])
+        return subset
+
+    @property
+    def chromatic(self):
+        return (~self.neutral).astype(np.float32)
+
+def pair_scores(a, b):
+    """Score every item in slot `a` against every item in slot `b`; shape (len(a), len(b))."""
+    season_ok = (a.season[:, None] & b.season[None, :]) != 0
+    scores = np.where(season_ok, SEASON_MATCH, SEASON_MISMATCH).astype(np.float32)
+
+    either_neutral = a.neutral[:, None] | b.neutral[None, :]
+    both_hued = a.has_hue[:, None] & b.has_hue[None, :]
+    hue_cos = a.hue @ b.hue.T
+    chromatic_score = np.where(
+        hue_cos >= ANALOGOUS_COS, ANALOGOUS_MATCH,
+        np.where(hue_cos <= COMPLEMENTARY_COS, COMPLEMENTARY_MATCH, COLOR_CLASH),
+    )
+    scores += np.where(either_neutral, NEUTRAL_MATCH, np.where(both_hued, chromatic_score, 0.0))
+
+    scores += np.where(a.patterned[:, None] & b.patterned[None, :], PATTERN_CLASH, 0.0)
+    return scores
+
+def extra_color_penalty(chromatic_count):
+    return EXTRA_COLOR_PENALTY * np.maximum(chromatic_count - 2, 0)
+
+class FeatureCache:
+    """Outfit features for one database, refreshed from the item change feed."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cursor = 0
+        self.features = {}
+        self.slots = None
+
+    def refresh(self, db):
+        """Apply item changes since the last refresh and return the per-slot features."""
+        with self.lock:
+            cursor, changed_ids, deleted_ids = item_changes_since(db, self.cursor)
+            if cursor != self.cursor:
+                self.cursor = cursor
+                for item_id in deleted_ids:
+                    self.features.pop(item_id, None)
+                for batch in in_batches(changed_ids):
+                    items = db.query(Item).options(selectinload(Item.colors)).filter(Item.id.in_(batch)).all()
+                    for item in items:
+                        if item.status == 'active':
+                            self.features[item.id] = item_features(item)
+                        else:
+                            # Archived, donated and sold items aren't worn anymore
+                            self.features.pop(item.id, None)
+                self.slots = None
+
+            if self.slots is None:
+                rows = {slot: [] for slot in SLOTS}
+                for item_id, features in sorted(self.features.items()):
+                    if features[0] is not None:
+                        rows[features[0]].append((item_id, features))
+                self.slots = {slot: SlotFeatures(rows[slot]) for slot in SLOTS}
+            return self.slots
+
+_caches = per_database(FeatureCache)
+
+def get_slot_features(db, season=None):
+    """Return the per-slot features for a session's database, optionally filtered to a season."""
+    slots = _caches.get(db).refresh(db)
+    if season:
+        mask = season_mask(season)
+        slots = {slot: features.subset((features.season & mask) != 0) for slot, features in slots.items()}
+    return slots
+
+def _top_indices(scores, count):
+    """Indices of the `count` highest values of a flat array, best first."""
+    count = min(count, scores.size)
+    if count == 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-scores, count - 1)[:count]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def _best_per_row(scores, per_row, beam_width):
+    """
+    Return (row, column) indices of the best entries of a 2-D score array.
+
+    Each row contributes at most `per_row` entries, so a single strong row
+    can't fill the whole beam; of those the best `beam_width` are kept.
+    """
+    per_row = min(per_row, scores.shape[1])
+    columns = np.argpartition(-scores, per_row - 1, axis=1)[:, :per_row]
+    rows = np.repeat(np.arange(scores.shape[0]), per_row)
+    columns = columns.ravel()
+    flat = scores[rows, columns]
+    keep = _top_indices(np.where(np.isfinite(flat), flat, -np.inf), beam_width)
+    keep = keep[np.isfinite(flat[keep])]
+    return rows[keep], columns[keep]
+
+def recommend_outfits(slots, limit=10, include_outerwear=False, max_item_use=2, beam_width=None):
+    """
+    Return the best-scoring outfits as dicts of slot -> item id plus 'score'.
+
+    Candidates are built slot by slot with a beam search: the best
+    top/bottom pairs are extended with shoes (and optionally outerwear),
+    keeping only the strongest partial outfits at each step. Each item is
+    used in at most `max_item_use` of the returned outfits; when the beam
+    runs out, items that reached that limit are masked and it is rerun,
+    skipping outfits already returned.
+    """
+    used_slots = SLOTS if include_outerwear else SLOTS[:3]
+    features = [slots[slot] for slot in used_slots]
+    if any(not len(slot_features) for slot_features in features):
+        return []
+    beam_width = beam_width or max(limit * 20, 200)
+
+    # Pair scores between every two slots, computed once
+    pairs = {(i, j): pair_scores(features[i], features[j]) for i in range(len(features)) for j in range(i + 1, len(features))}
+    chromatic = [slot_features.chromatic for slot_features in features]
+    uses = [np.zeros(len(slot_features), dtype=np.int64) for slot_features in features]
+
+    outfits = []
+    emitted = set()
+    while len(outfits) < limit:
+        available = [count < max_item_use for count in uses]
+
+        # Start from top/bottom pairs, then add one slot at a time
+        masked = np.where(available[0][:, None] & available[1][None, :], pairs[(0, 1)], -np.inf)
+        rows, columns = _best_per_row(masked, max_item_use, beam_width)
+        chosen = [rows, columns]
+        scores = masked[rows, columns]
+        for slot in range(2, len(features)):
+            extended = scores[:, None] + sum(pairs[(i, slot)][chosen[i]] for i in range(slot))
+            colors = sum(chromatic[i][chosen[i]] for i in range(slot))
+            extended -= extra_color_penalty(colors[:, None] + chromatic[slot][None, :])
+            extended += extra_color_penalty(colors)[:, None]  # already applied for the earlier pieces
+            extended[:, ~available[slot]] = -np.inf
+            rows, columns = _best_per_row(extended, max_item_use, beam_width)
+            chosen = [index[rows] for index in chosen] + [columns]
+            scores = extended[rows, columns]
+        if not len(scores):
+            break
+
+        # Take the candidates in order, respecting the per-item limit
+        found = len(outfits)
+        for i in range(len(scores)):
+            pieces = tuple(int(index[i]) for index in chosen)
+            if pieces in emitted or any(uses[slot][piece] >= max_item_use for slot, piece in enumerate(pieces)):
+                continue
+            emitted.add(pieces)
+            for slot, piece in enumerate(pieces):
+                uses[slot][piece] += 1
+            outfit = {slot: int(features[j].ids[piece]) for j, (slot, piece) in enumerate(zip(used_slots, pieces))}
+            outfit['score'] = round(float(scores[i]), 3)
+            outfits.append(outfit)
+            if len(outfits) >= limit:
+                break
+        if len(outfits) == found:
+            # Only outfits already returned are left
+            break
+    return outfits
+
+def build_capsule(slots, days=7, min_score=4.0):
+    """
+    Pick a small set of tops, bottoms and shoes giving at least `days` good outfits.
+
+    Starts from the best single outfit and greedily adds whichever item
+    unlocks the most new combinations scoring at least `min_score`.
+
+    Returns (item ids, outfits) where outfits are the best `days`
+    combinations within the capsule, or (ids, fewer outfits) if the
+    wardrobe can't cover that many days.
+    """
+    tops, bottoms, shoes = slots['top'], slots['bottom'], slots['shoes']
+    best = recommend_outfits(slots, limit=1)
+    if not best:
+        return [], []
+
+    top_bottom = pair_scores(tops, bottoms)
+    top_shoes = pair_scores(tops, shoes)
+    bottom_shoes = pair_scores(bottoms, shoes)
+    chromatic = (tops.chromatic, bottoms.chromatic, shoes.chromatic)
+
+    selected = [
+        [int(np.flatnonzero(tops.ids == best[0]['top'])[0])],
+        [int(np.flatnonzero(bottoms.ids == best[0]['bottom'])[0])],
+        [int(np.flatnonzero(shoes.ids == best[0]['shoes'])[0])],
+    ]
+
+    def outfit_scores(t, b, s):
+        """Scores for every combination of the given index arrays; shape (len(t), len(b), len(s))."""
+        colors = chromatic[0][t][:, None, None] + chromatic[1][b][None, :, None] + chromatic[2][s][None, None, :]
+        return (
+            top_bottom[np.ix_(t, b)][:, :, None]
+            + top_shoes[np.ix_(t, s)][:, None, :]
+            + bottom_shoes[np.ix_(b, s)][None, :, :]
+            - extra_color_penalty(colors)
+        )
+
+    def count_good(scores, axis):
+        good = scores >= min_score
+        other_axes = tuple(i for i in range(3) if i != axis)
+        return good.sum(axis=other_axes), np.where(good, scores, 0).sum(axis=other_axes)
+
+    everything = [np.arange(len(tops)), np.arange(len(bottoms)), np.arange(len(shoes))]
+    covered = int((outfit_scores(*map(np.array, selected)) >= min_score).sum())
+    while covered < days:
+        best_gain, best_quality, best_choice = 0, 0.0, None
+        for axis in range(3):
+            # Score every candidate for this slot against the current capsule
+            index = [np.array(chosen) for chosen in selected]
+            index[axis] = everything[axis]
+            gain, quality = count_good(outfit_scores(*index), axis)
+            gain[selected[axis]] = 0
+            candidate = int(np.lexsort((-quality, -gain))[0])
+            if gain[candidate] and (gain[candidate], quality[candidate]) > (best_gain, best_quality):
+                best_gain, best_quality, best_choice = int(gain[candidate]), float(quality[candidate]), (axis, candidate)
+        if best_choice is None:
+            break
+        selected[best_choice[0]].append(best_choice[1])
+        covered += best_gain
+
+    t, b, s = (np.array(chosen) for chosen in selected)
+    scores = outfit_scores(t, b, s)
+    order = _top_indices(scores.ravel(), min(days, covered))
+    i, j, k = np.unravel_index(order, scores.shape)
+    outfits = [
+        {
+            'top': int(tops.ids[t[x]]),
+            'bottom': int(bottoms.ids[b[y]]),
+            'shoes': int(shoes.ids[s[z]]),
+            'score': round(float(scores[x, y, z]), 3),
+        }
+        for x, y, z in zip(i, j, k)
+    ]
+    item_ids = [int(ids[index]) for ids, chosen in zip((tops.ids, bottoms.ids, shoes.ids), selected) for index in chosen]
+    return item_ids, outfits
@@ -0,0 +1,86 @@
+"""
+Reference colours for the colour names used in the wardrobe.
+
+Maps the free-text colour names stored on items to RGB so they can be
+compared numerically (hue harmony, nearest named colour).
+"""
+import colorsys
+import re
+
+COLOR_RGB = {
+    'black': (20, 20, 20),
+    'white': (245, 245, 245),
+    'off-white': (240, 234, 214),
+    'cream': (255, 253, 208),
+    'ivory': (255, 255, 240),
+    'grey': (128, 128, 128),
+    'charcoal': (54, 69, 79),
+    'silver': (192, 192, 192),
+    'beige': (222, 203, 164),
+    'stone': (173, 165, 135),
+    'taupe': (72, 60, 50),
+    'tan': (210, 180, 140),
+    'camel': (193, 154, 107),
+    'khaki': (195, 176, 145),
+    'brown': (110, 72, 40),
+    'navy': (20, 32, 72),
+    'denim': (21, 96, 189),
+    'blue': (30, 90, 200),
+    'light blue': (150, 190, 230),
+    'teal': (0, 128, 128),
+    'turquoise': (64, 224, 208),
+    'green': (40, 140, 60),
+    'olive': (110, 110, 40),
+    'mint': (170, 240, 200),
+    'yellow': (240, 210, 40),
+    'mustard': (205, 160, 30),
+    'gold': (212, 175, 55),
+    'orange': (240, 130, 30),
+    'rust': (183, 65, 14),
+    'red': (200, 30, 40),
+    'burgundy': (110, 20, 40),
+    'pink': (240, 150, 180),
+    'coral': (250, 120, 100),
+    'purple': (110, 50, 150),
+    'lilac': (200, 162, 200),
+}
+
+# Spelling variants of palette colours
+COLOR_ALIASES = {
+    'gray': 'grey',
+}
+
+# Colours that go with anything
+NEUTRAL_COLORS = {
+    'black', 'white', 'off-white', 'cream', 'ivory', 'grey', 'charcoal',
+    'silver', 'beige', 'stone', 'taupe', 'tan', 'camel', 'khaki', 'brown', 'navy', 'denim',
+}
+
+def normalize_color_name(name):
+    """Return the palette name for a free-text colour, or None if unknown."""
+    name = (name or '').strip().lower()
+    name = COLOR_ALIASES.get(name, name)
+    if name in COLOR_RGB:
+        return name
+    # "Forest green", "dark-navy": fall back to the last known word
+    for word in reversed(re.split(r'[\s/_-]+', name)):
+        word = COLOR_ALIASES.get(word, word)
+        if word in COLOR_RGB:
+            return word
+    return None
+
+def color_rgb(name):
+    """Return the reference RGB tuple for a colour name, or None if unknown."""
+    palette_name = normalize_color_name(name)
+    return COLOR_RGB[palette_name] if palette_name else None
+
+def is_neutral(name):
+    """Whether a colour name is a neutral; unknown colours are not."""
+    return normalize_color_name(name) in NEUTRAL_COLORS
+
+def color_hue(name):
+    """Return the hue of a colour name in [0, 1), or None if unknown."""
+    rgb = color_rgb(name)
+    if rgb is None:
+        return None
+    return colorsys.rgb_to_hsv(*(channel / 255 for channel in rgb))[0]
@@ -0,0 +1,113 @@
+"""
+Streaming readers and writers for the import/export file formats.
+
+Rows are handled one at a time in both directions so memory use stays flat
+for sheets with hundreds of thousands of rows.
+"""
+import codecs
+import csv
+import datetime
+import io
+import os
+
+from openpyxl import Workbook, load_workbook
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def file_format(filename):
+    """Return 'csv' or 'xlsx' for a supported filename, otherwise None."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        return None
+    return extension[1:]
+
+def cell_to_str(value):
+    """Render an Excel cell the way it would have appeared in a CSV file."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time(0, 0):
+            return value.date().isoformat()
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def read_table(file, fmt):
+    """
+    Open an uploaded CSV or XLSX file for reading.
+
+    file: Binary, seekable file object (e.g. UploadFile.file)
+    fmt: 'csv' or 'xlsx'
+
+    Returns (headers, rows) where rows lazily yields one dict per data row,
+    mapping each header to the cell text. This is the same shape
+    csv.DictReader produces, so column mappings work for both formats.
+    """
+    file.seek(0)
+    if fmt == 'xlsx':
+        return _read_xlsx(file)
+    reader = csv.DictReader(codecs.iterdecode(file, 'utf-8'))
+    return reader.fieldnames or [], reader
+
+def _read_xlsx(file):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    header_row = next(rows, None) or ()
+    headers = [cell_to_str(value) for value in header_row]
+
+    def iter_rows():
+        try:
+            for values in rows:
+                row = {header: '' for header in headers}
+                for header, value in zip(headers, values):
+                    row[header] = cell_to_str(value)
+                yield row
+        finally:
+            workbook.close()
+
+    return headers, iter_rows()
+
+def write_table(rows, fileobj, fmt, sheet_title='Items'):
+    """
+    Write an iterable of row lists (header first) to a binary file object.
+
+    Rows are consumed one at a time; the XLSX writer runs in openpyxl's
+    write-only mode, which spills rows to disk instead of keeping cells in
+    memory.
+    """
+    if fmt == 'xlsx':
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(title=sheet_title)
+        for row in rows:
+            worksheet.append(row)
+        workbook.save(fileobj)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        fileobj.write(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+
+def iter_file(fileobj, chunk_size=64 * 1024):
+    """Yield a file in chunks from the start, closing it when done."""
+    try:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
@@ -28,7 +28,7 @@ const ImportForm = ({ onClose, onImportComplete }) => {
       setPreviewData(response.data);
       setStep('map');
     } catch (error) {
-      setError('Error processing file. Please make sure it\'s a valid CSV file.');
+      setError('Error processing file. Please make sure it\'s a valid CSV or Excel file.');
       console.error('Error:', error);
     } finally {
       setIsLoading(false);
@@ -72,7 +72,7 @@ const ImportForm = ({ onClose, onImportComplete }) => {
   return (
     <div className="bg-white rounded-lg shadow p-6">
       <div className="flex justify-between items-center mb-4">
-        <h2 className="text-xl font-semibold">Import Items from CSV</h2>
+        <h2 className="text-xl font-semibold">Import Items from CSV or Excel</h2>
         <button
           onClick={onClose}
           className="text-gray-400 hover:text-gray-500"
@@ -86,16 +86,16 @@ const ImportForm = ({ onClose, onImportComplete }) => {
 
       {step === 'upload' && (
         <div className="mb-4">
-          <label className="block text-gray-700 mb-1">CSV File</label>
+          <label className="block text-gray-700 mb-1">CSV or Excel File</label>
           <input
             type="file"
-            accept=".csv"
+            accept=".csv,.xlsx"
             onChange={handleFileChange}
             className="w-full px-3 py-2 border border-gray-300 rounded focus:outline-none focus:ring-2 focus:ring-blue-500"
             required
           />
           <p className="text-sm text-gray-500 mt-1">
-            Upload your CSV file to start the import process.
+            Upload your CSV or Excel (.xlsx) file to start the import process.
           </p>
         </div>
       )}
@@ -30,7 +30,7 @@ const ImportPage = () => {
       setPreviewData(response.data);
       setStep('map');
     } catch (error) {
-      setError('Error processing file. Please make sure it\'s a valid CSV file.');
+      setError('Error processing file. Please make sure it\'s a valid CSV or Excel file.');
       console.error('Error:', error);
     } finally {
       setIsLoading(false);
@@ -89,16 +89,16 @@ const ImportPage = () => {
 
         {step === 'upload' && (
           <div className="bg-white rounded-lg shadow p-6">
-            <label className="block text-gray-700 mb-1">CSV File</label>
+            <label className="block text-gray-700 mb-1">CSV or Excel File</label>
             <input
               type="file"
-              accept=".csv"
+              accept=".csv,.xlsx"
               onChange={handleFileChange}
               className="w-full px-3 py-2 border border-gray-300 rounded focus:outline-none focus:ring-2 focus:ring-blue-500"
               required
             />
             <p className="text-sm text-gray-500 mt-1">
-              Upload your CSV file to start the import process.
+              Upload your CSV or Excel (.xlsx) file to start the import process.
             </p>
           </div>
         )}